@@ -0,0 +1,71 @@
+"""
+Fixtures shared by the tests: a fresh database in a temporary home, and a
+stand-in for the requests session that serves feeds and article pages.
+"""
+
+import sqlite3
+
+import pytest
+import requests
+
+from trackthenews import core
+
+PAGE = """<html><body><article>
+<p>The newspaper obtained the emails through a public records request filed last year.</p>
+<p>A second paragraph that is long enough for readability to keep around as content.</p>
+</article></body></html>
+"""
+
+
+class FakeResponse:
+    def __init__(self, url, text, status_code=200):
+        self.url = url
+        self.text = text
+        self.status_code = status_code
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} for {self.url}", response=self)
+
+
+class FakeSession:
+    """
+    Serves feed for URLs ending in /feed, and page for anything else.
+
+    If pages is set, only the URLs in it are served, and anything else is a 404.
+    """
+
+    def __init__(self, feed="", page=PAGE, pages=None):
+        self.feed = feed
+        self.page = page
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url, timeout):
+        self.requested.append(url)
+        if url.endswith("/feed"):
+            return FakeResponse(url, self.feed)
+        if self.pages is None:
+            return FakeResponse(url, self.page)
+        if url in self.pages:
+            return FakeResponse(url, self.pages[url])
+        return FakeResponse(url, "", status_code=404)
+
+
+@pytest.fixture
+def http_session():
+    return FakeSession()
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "home", str(tmp_path), raising=False)
+    core.setup_db({"db": "trackthenews.db"})
+    conn = sqlite3.connect(tmp_path / "trackthenews.db")
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def seen_filter(tmp_path, conn):
+    return core.load_seen_filter(conn, str(tmp_path / core.SEEN_FILTER_FILENAME))
@@ -0,0 +1,138 @@
+"""
+Tests for coordinating several workers that share one database.
+"""
+
+import sqlite3
+import threading
+
+import pytest
+import requests
+
+from trackthenews import core
+from trackthenews.matcher import Matcher
+
+# Both workers' feeds carry the same twenty stories.
+FEED = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Example</title>
+{items}
+</channel></rss>
+""".format(
+    items="".join(
+        f"<item><title>Story {i}</title><link>https://example.com/{i}</link></item>"
+        for i in range(20)
+    )
+)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "home", str(tmp_path), raising=False)
+    monkeypatch.setattr(core, "config", {}, raising=False)
+    core.setup_db({"db": "trackthenews.db"})
+    return tmp_path / "trackthenews.db"
+
+
+def worker(database, name, **kwargs):
+    conn = sqlite3.connect(database, timeout=30, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return core.SQLiteCoordinator(conn, name, **kwargs)
+
+
+def test_workers_only_coordinate_when_sharding_is_configured(database, monkeypatch):
+    conn = sqlite3.connect(database)
+    assert core.load_coordinator(conn) is None
+
+    monkeypatch.setattr(core, "config", {"shard": {"hold_minutes": 5}}, raising=False)
+    coordinator = core.load_coordinator(conn)
+    assert isinstance(coordinator, core.SQLiteCoordinator)
+    assert coordinator.hold_seconds == 300
+
+
+def test_only_one_worker_holds_a_feed_lease(database):
+    a, b = worker(database, "a"), worker(database, "b", hold_seconds=60)
+
+    assert a.acquire_feed("https://example.com/feed")
+    assert a.acquire_feed("https://example.com/feed")  # Renewing is fine...
+    assert not b.acquire_feed("https://example.com/feed")  # ...taking it over isn't.
+
+    a.release_feed("https://example.com/feed")
+    assert b.acquire_feed("https://example.com/feed")
+
+    # b holds on to the feed for a while after polling it.
+    b.release_feed("https://example.com/feed")
+    assert not a.acquire_feed("https://example.com/feed")
+
+
+def test_expired_leases_and_claims_can_be_taken_over(database):
+    a, b = worker(database, "a", lease_seconds=-1), worker(database, "b")
+
+    assert a.acquire_feed("https://example.com/feed")
+    assert a.claim_article("https://example.com/1")
+
+    assert b.acquire_feed("https://example.com/feed")
+    assert b.claim_article("https://example.com/1")
+
+
+def test_articles_are_claimed_once_and_never_after_being_recorded(database):
+    a, b = worker(database, "a"), worker(database, "b")
+
+    assert a.claim_article("https://example.com/1")
+    assert not b.claim_article("https://example.com/1")
+
+    # Deferred: the article is up for grabs again.
+    a.release_article("https://example.com/1", recorded=False)
+    assert b.claim_article("https://example.com/1")
+
+    a.conn.execute("insert into articles(url) values ('https://example.com/1')")
+    a.conn.commit()
+    b.release_article("https://example.com/1", recorded=True)
+    assert not a.claim_article("https://example.com/1")
+
+
+def test_deferred_articles_are_not_claimed_until_their_retry_is_due(database):
+    a, b = worker(database, "a"), worker(database, "b")
+    article = core.Article("Down", "Story", "https://down.example/story")
+    article.error = requests.ConnectionError()
+
+    assert a.claim_article(article.url)
+    core.defer_article(a.conn, core.BloomFilter(100), article)
+    a.release_article(article.url, recorded=False)
+
+    # b's seen filter may not know about the deferral, but its claim does.
+    assert not b.claim_article(article.url)
+
+    b.conn.execute("update retries set next_attempt = '2000-01-01 00:00:00+00:00'")
+    b.conn.commit()
+    assert b.claim_article(article.url)
+
+
+def test_concurrent_workers_post_each_article_once(database, monkeypatch, http_session):
+    monkeypatch.setattr(core, "matcher", Matcher(["public records"], []), raising=False)
+    monkeypatch.setattr(core.time, "sleep", lambda seconds: None)
+    posted = []
+    monkeypatch.setattr(core.Article, "tweet", lambda self: posted.append(self.url))
+    monkeypatch.setattr(core.Article, "toot", lambda self: None)
+    http_session.feed = FEED
+
+    def run(name, feed_url):
+        coordinator = worker(database, name)
+        conn = coordinator.conn
+        seen_filter = core.load_seen_filter(conn, str(database.parent / f"{name}.bloom"))
+        feed = {"outlet": name, "url": feed_url, "delicate": False, "redirects": False}
+        core.poll_feed(feed, conn, seen_filter, http_session, coordinator=coordinator)
+
+    # Two workers, two different feeds, but the same articles in both.
+    threads = [
+        threading.Thread(target=run, args=("a", "https://one.example/feed")),
+        threading.Thread(target=run, args=("b", "https://two.example/feed")),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(posted) == sorted(f"https://example.com/{i}" for i in range(20))
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("select count(distinct url), count(*) from articles").fetchone() == (20, 20)
+    assert conn.execute("select count(*) from article_claims").fetchone() == (0,)
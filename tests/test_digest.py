@@ -0,0 +1,254 @@
+"""
+Tests for digest mode, which batches matches into combined statuses and threads.
+"""
+
+import datetime
+import re
+import types
+
+import pytest
+import requests
+import tweepy
+from mastodon import MastodonNetworkError
+
+from trackthenews import core
+from trackthenews.matcher import Matcher
+
+
+class FakeTwitter:
+    def __init__(self, fail_after=None):
+        self.tweets = []
+        self.fail_after = fail_after
+
+    def create_tweet(self, text, media_ids, in_reply_to_tweet_id=None):
+        if len(self.tweets) == self.fail_after:
+            response = requests.Response()
+            response.status_code = 429
+            response._content = b"{}"
+            raise tweepy.errors.TooManyRequests(response)
+        self.tweets.append((text, media_ids, in_reply_to_tweet_id))
+        return types.SimpleNamespace(data={"id": f"tweet-{len(self.tweets)}"})
+
+
+class FakeMastodon:
+    def __init__(self, fail_after=None):
+        self.toots = []
+        self.uploads = 0
+        self.fail_after = fail_after
+
+    def media_post(self, img_file, mime_type, description):
+        self.uploads += 1
+        return {"id": f"media-{self.uploads}"}
+
+    def status_post(self, status, media_ids, in_reply_to_id=None):
+        if len(self.toots) == self.fail_after:
+            raise MastodonNetworkError("rate limited")
+        self.toots.append((status, media_ids, in_reply_to_id))
+        return {"id": f"toot-{len(self.toots)}"}
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    config = {
+        "color": "#F5F5F5",
+        "font": "NotoSerif-Regular.ttf",
+        "digest": {"window_minutes": 30},
+        "twitter": {},
+        "mastodon": {},
+    }
+    monkeypatch.setattr(core, "config", config, raising=False)
+    monkeypatch.setattr(core, "matcher", Matcher(["public records"], []), raising=False)
+    monkeypatch.setattr(core.time, "sleep", lambda seconds: None)
+    return config
+
+
+@pytest.fixture
+def twitter(monkeypatch):
+    twitter = FakeTwitter()
+    monkeypatch.setattr(core, "get_twitter_client", lambda: twitter)
+    monkeypatch.setattr(
+        core,
+        "upload_twitter_images",
+        lambda img_files: [types.SimpleNamespace(media_id=i) for i, _ in enumerate(img_files)],
+    )
+    return twitter
+
+
+@pytest.fixture
+def mastodon(monkeypatch):
+    mastodon = FakeMastodon()
+    monkeypatch.setattr(core, "get_mastodon_instance", lambda: mastodon)
+    return mastodon
+
+
+def articles(count):
+    return [
+        core.Article(
+            f"Outlet {i}",
+            f"A rather long headline about records, number {i}",
+            f"https://example.com/{i}",
+        )
+        for i in range(count)
+    ]
+
+
+def posted_length(text):
+    # Links count as 23 characters, however long they are.
+    return len(re.sub(r"https://\S+", "x" * 23, text))
+
+
+def test_statuses_are_packed_within_the_limit():
+    batch = articles(12)
+    for article in batch:
+        article.matching_grafs = ["An excerpt."]
+
+    statuses = core.digest_statuses(batch, core.TWITTER_MAX_CHARS)
+
+    assert len(statuses) > 1
+    assert statuses[0][0].startswith("12 new matches:\n")
+    assert all(posted_length(text) <= core.TWITTER_MAX_CHARS for text, _ in statuses)
+    assert [article for _, listed in statuses for article in listed] == batch
+
+    ((text, listed),) = core.digest_statuses(batch[:2], core.MASTODON_MAX_CHARS)
+    assert listed == batch[:2]
+    assert text.count("https://example.com/") == 2
+
+
+def test_matches_are_queued_and_posted_together(
+    conn, seen_filter, http_session, twitter, mastodon, config
+):
+    core.process_articles(articles(10), conn, seen_filter, http_session)
+
+    # Nothing goes out until the window has passed.
+    core.flush_digest(conn)
+    assert twitter.tweets == mastodon.toots == []
+    assert conn.execute("select count(*) from pending_posts").fetchone() == (10,)
+
+    config["digest"]["window_minutes"] = 0
+    core.flush_digest(conn)
+
+    # Far fewer requests than the 10 statuses and up to 40 uploads of posting one by one.
+    assert 1 < len(twitter.tweets) < 10
+    assert [reply_to for _, _, reply_to in twitter.tweets] == [None] + [
+        f"tweet-{i}" for i in range(1, len(twitter.tweets))
+    ]
+    assert all(len(media_ids) <= 4 for _, media_ids, _ in twitter.tweets)
+    assert len(mastodon.toots) < len(twitter.tweets)
+    assert mastodon.uploads <= 4 * len(mastodon.toots)
+
+    assert conn.execute("select count(*) from pending_posts").fetchone() == (0,)
+    assert conn.execute("select count(*) from articles where tweeted and tooted").fetchone() == (
+        10,
+    )
+
+
+def test_digest_can_be_turned_on_with_its_default_window(conn, seen_filter, http_session, config):
+    config["digest"] = True
+    core.process_articles(articles(2), conn, seen_filter, http_session)
+
+    (queued_at,) = conn.execute("select min(queued_at) from pending_posts").fetchone()
+    assert core.digest_due(conn) == datetime.datetime.fromisoformat(queued_at) + datetime.timedelta(
+        minutes=core.DIGEST_WINDOW_MINUTES
+    )
+
+
+def test_unposted_matches_are_requeued_when_posting_fails(
+    conn, seen_filter, http_session, monkeypatch, config
+):
+    del config["twitter"]
+    mastodon = FakeMastodon(fail_after=1)
+    monkeypatch.setattr(core, "get_mastodon_instance", lambda: mastodon)
+    config["digest"]["window_minutes"] = 0
+    core.process_articles(articles(10), conn, seen_filter, http_session)
+
+    with pytest.raises(MastodonNetworkError):
+        core.flush_digest(conn)
+
+    assert len(mastodon.toots) == 1
+    (posted_count,) = conn.execute("select count(*) from articles where tooted").fetchone()
+    (pending_count,) = conn.execute("select count(*) from pending_posts").fetchone()
+    assert posted_count > 0
+    assert posted_count + pending_count == 10
+
+
+def test_each_platform_is_retried_only_for_what_it_missed(
+    conn, seen_filter, http_session, twitter, mastodon, config
+):
+    config["digest"]["window_minutes"] = 0
+    twitter.fail_after = 1
+    core.process_articles(articles(12), conn, seen_filter, http_session)
+
+    with pytest.raises(tweepy.errors.TooManyRequests):
+        core.flush_digest(conn)
+
+    # Mastodon still got the whole digest, and Twitter its first tweet.
+    ((text, _, _),) = twitter.tweets
+    assert text.startswith("12 new matches:")
+    assert conn.execute("select count(*) from articles where tooted").fetchone() == (12,)
+    (tweeted,) = conn.execute("select count(*) from articles where tweeted").fetchone()
+    assert 0 < tweeted < 12
+    assert conn.execute(
+        "select count(*), sum(tweeted), sum(tooted) from pending_posts"
+    ).fetchone() == (
+        12 - tweeted,
+        0,
+        12 - tweeted,
+    )
+
+    twitter.fail_after = None
+    toots = list(mastodon.toots)
+    core.flush_digest(conn)
+
+    assert twitter.tweets[1][0].startswith(f"{12 - tweeted} new matches:")
+    assert mastodon.toots == toots
+    assert conn.execute("select count(*) from articles where tweeted and tooted").fetchone() == (
+        12,
+    )
+    assert conn.execute("select count(*) from pending_posts").fetchone() == (0,)
+
+
+def test_apply_migrations_adds_delivery_columns_to_pending_posts(conn):
+    conn.executescript(
+        """drop table pending_posts;
+        create table pending_posts (
+            url text primary key not null, title text, outlet text,
+            grafs text not null, queued_at datetime not null
+        );"""
+    )
+
+    core.apply_migrations(conn)
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(pending_posts)")]
+    assert columns[-2:] == ["tweeted", "tooted"]
+
+
+def test_a_failed_digest_doesnt_stop_other_bots_or_skip_closing(tmp_path, monkeypatch):
+    for name in ("first", "second"):
+        directory = tmp_path / name
+        directory.mkdir()
+        (directory / "config.yaml").write_text(f"user-agent: {name}\ndb: trackthenews.db\n")
+        (directory / "matchlist.txt").write_text("public records\n")
+        (directory / "matchlist_case_sensitive.txt").write_text("")
+        (directory / "rssfeeds.json").write_text("[]")
+    for name in ("home", "ua"):
+        monkeypatch.setattr(core, name, None, raising=False)
+    monkeypatch.setattr(core, "image_cache", None)
+    monkeypatch.setattr(core, "poll_shared_feeds", lambda bots, http_session: None)
+    monkeypatch.setattr(
+        "sys.argv", ["trackthenews", str(tmp_path / "first"), str(tmp_path / "second")]
+    )
+
+    flushed = []
+
+    def flush_digest(conn):
+        flushed.append(core.ua)
+        if core.ua == "first":
+            raise MastodonNetworkError("rate limited")
+
+    monkeypatch.setattr(core, "flush_digest", flush_digest)
+
+    core.main()
+
+    assert flushed == ["first", "second"]
+    for name in ("first", "second"):
+        assert (tmp_path / name / core.SEEN_FILTER_FILENAME).exists()
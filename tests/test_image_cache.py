@@ -0,0 +1,89 @@
+"""
+Tests for the on-disk cache of rendered excerpt images.
+"""
+
+import os
+
+import pytest
+
+from trackthenews import core
+from trackthenews.image_cache import ImageCache, image_key
+
+GRAF = "A paragraph mentioning a public records request."
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    monkeypatch.setattr(
+        core, "config", {"color": "#F5F5F5", "font": "NotoSerif-Regular.ttf"}, raising=False
+    )
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ImageCache(str(tmp_path / "image-cache"), 1024 * 1024, core.IMAGE_FORMAT)
+    monkeypatch.setattr(core, "image_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    renders = []
+    render_img = core.render_img
+
+    def counting_render_img(graf, **kwargs):
+        renders.append(graf)
+        return render_img(graf, **kwargs)
+
+    monkeypatch.setattr(core, "render_img", counting_render_img)
+    return renders
+
+
+def test_keys_cover_every_input():
+    key = image_key(GRAF, "NotoSerif-Regular.ttf", "#F5F5F5", 60, False, "jpeg", 95)
+
+    assert key == image_key(GRAF, "NotoSerif-Regular.ttf", "#F5F5F5", 60, False, "jpeg", 95)
+    assert key != image_key(GRAF, "NotoSerif-Regular.ttf", "#F5F5F5", 60, True, "jpeg", 95)
+    assert key != image_key(GRAF, "NotoSerif-Regular.ttf", "#FFFFFF", 60, False, "jpeg", 95)
+    assert image_key("ab", "c") != image_key("a", "bc")
+
+
+def test_repeated_excerpts_are_rendered_once(cache, renders):
+    first = core.render_img_bytes(GRAF)
+    assert core.render_img_bytes(GRAF) == first
+    assert renders == [GRAF]
+
+    # A different layout of the same paragraph is a different image.
+    core.render_img_bytes(GRAF, square=True)
+    assert renders == [GRAF, GRAF]
+
+
+def test_articles_share_cached_images(cache, renders):
+    for outlet in ("Outlet A", "Outlet B"):
+        article = core.Article(outlet=outlet, title="Records", url=f"https://{outlet}.example/")
+        article.matching_grafs = [GRAF]
+        (img_file,) = article.prepare_images(square=False)
+        assert img_file.read()[:2] == b"\xff\xd8"  # A JPEG.
+
+    assert renders == [GRAF]
+
+
+def test_least_recently_used_images_are_evicted(tmp_path):
+    cache = ImageCache(str(tmp_path), 25, "jpeg")
+    for i, key in enumerate(("a", "b", "c")):
+        cache.put(key, b"x" * 10)
+        os.utime(cache.path(key), ns=(i * 10**9, i * 10**9))
+        if key == "b":
+            # Reading "a" makes "b" the least recently used.
+            assert cache.get("a") == b"x" * 10
+
+    assert cache.get("b") is None
+    assert cache.get("a") == cache.get("c") == b"x" * 10
+    assert cache.size == 20
+
+
+def test_images_bigger_than_the_cache_are_not_cached(tmp_path):
+    cache = ImageCache(str(tmp_path), 5, "jpeg")
+    cache.put("a", b"x" * 10)
+
+    assert cache.get("a") is None
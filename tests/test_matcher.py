@@ -0,0 +1,126 @@
+"""
+Tests for the compiled matcher and the on-disk cache it is stored in.
+"""
+
+import os
+
+import pytest
+
+from trackthenews import core
+from trackthenews.artifact import CachedArtifact
+from trackthenews.matcher import Matcher, trie_pattern
+
+WORDS = ["FOIA", "Freedom of Information", "public record", "public records act"]
+WORDS_CASE_SENSITIVE = ["ACLU", "FOI"]
+GRAFS = [
+    "They filed a foia request.",
+    "Under the freedom of information law, the city responded.",
+    "The Public Records Act applies here.",
+    "An aclu lawyer, lowercased, doesn't count.",
+    "The ACLU sued.",
+    "A FOI request.",
+    "Nothing to see here.",
+    "",
+]
+
+
+def naive_matches(graf):
+    """The matching rule compiled matchers have to agree with."""
+    return any(w.lower() in graf.lower() for w in WORDS) or any(
+        w in graf for w in WORDS_CASE_SENSITIVE
+    )
+
+
+@pytest.mark.parametrize("graf", GRAFS)
+def test_matcher_agrees_with_substring_matching(graf):
+    assert Matcher(WORDS, WORDS_CASE_SENSITIVE).matches(graf) == naive_matches(graf)
+
+
+def test_trie_pattern_drops_words_that_extend_a_shorter_word():
+    assert trie_pattern(["public records act", "public record"]) == r"public\ record"
+    assert trie_pattern(["ab", "ac"]) == "a(?:b|c)"
+
+
+def test_matcher_without_words_is_falsy():
+    assert not Matcher([], [])
+    assert not Matcher([], []).matches("anything")
+
+
+@pytest.fixture
+def sources(tmp_path):
+    paths = [tmp_path / "a.txt", tmp_path / "b.txt"]
+    for path in paths:
+        path.write_text("one")
+    return [str(path) for path in paths]
+
+
+def test_cached_artifact_is_reused_until_a_source_changes(tmp_path, sources):
+    builds = []
+
+    def build():
+        builds.append(1)
+        return [open(path).read() for path in sources]
+
+    artifact_path = str(tmp_path / "compiled.pickle")
+    assert CachedArtifact(artifact_path, sources, build).refresh() is True
+
+    # A fresh process picks the value up from disk without rebuilding.
+    artifact = CachedArtifact(artifact_path, sources, build)
+    assert artifact.refresh() is True
+    assert artifact.value == ["one", "one"]
+    assert artifact.refresh() is False
+    assert len(builds) == 1
+
+    # Touching a file without changing it only costs a hash.
+    os.utime(sources[0], ns=(0, 0))
+    assert artifact.refresh() is False
+    assert len(builds) == 1
+
+    with open(sources[1], "w") as f:
+        f.write("two")
+    assert artifact.refresh() is True
+    assert artifact.value == ["one", "two"]
+    assert len(builds) == 2
+
+
+def test_reload_sources_keeps_the_previous_state_on_a_broken_edit(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "home", str(tmp_path), raising=False)
+    for name in ("config", "ua", "matcher"):
+        monkeypatch.setattr(core, name, None, raising=False)
+    (tmp_path / "config.yaml").write_text("user-agent: test\n")
+    (tmp_path / "matchlist.txt").write_text("foia\n")
+    (tmp_path / "matchlist_case_sensitive.txt").write_text("")
+    (tmp_path / "rssfeeds.json").write_text('[{"url": "https://example.com/feed"}]')
+
+    artifact = core.get_sources_artifact()
+    artifact.refresh()
+    core.apply_sources(artifact.value)
+    assert artifact.value["rss_feeds"] == [
+        {"outlet": "", "url": "https://example.com/feed", "delicate": False, "redirects": False}
+    ]
+
+    (tmp_path / "matchlist.txt").write_text("foia\nrecords\n")
+    core.reload_sources(artifact)
+    assert core.matcher.words == ["foia", "records"]
+
+    sources = artifact.value
+    for filename, broken in [
+        ("rssfeeds.json", "["),
+        ("rssfeeds.json", '{"url": "https://example.com/feed"}'),
+        ("rssfeeds.json", '[{"outlet": "No URL"}]'),
+        ("config.yaml", ""),
+        ("config.yaml", "db: trackthenews.db\n"),
+    ]:
+        path = tmp_path / filename
+        working = path.read_text()
+        path.write_text(broken)
+        core.reload_sources(artifact)
+        assert artifact.value is sources
+        assert core.matcher.words == ["foia", "records"]
+        assert core.ua == "test"
+        path.write_text(working)
+
+    # Once the files are fixed, their changes are picked up again.
+    (tmp_path / "config.yaml").write_text("user-agent: fixed\n")
+    core.reload_sources(artifact)
+    assert core.ua == "fixed"
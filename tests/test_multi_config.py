@@ -0,0 +1,113 @@
+"""
+Tests for serving several configuration directories from one process.
+"""
+
+import json
+import sqlite3
+
+import pytest
+import requests
+
+from trackthenews import core
+
+FEED = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Example</title>
+<item><title>Records</title><link>https://example.com/records</link></item>
+<item><title>Weather</title><link>https://example.com/weather</link></item>
+<item><title>Gone</title><link>https://example.com/gone</link></item>
+</channel></rss>
+"""
+
+PAGES = {
+    url: f"<html><body><article><p>{graf}</p></article></body></html>"
+    for url, graf in [
+        (
+            "https://example.com/records",
+            "The emails were released under a public records request.",
+        ),
+        ("https://example.com/weather", "Rain is expected across the region for the weekend."),
+    ]
+}
+
+
+@pytest.fixture
+def http_session(http_session):
+    http_session.feed = FEED
+    http_session.pages = PAGES
+    return http_session
+
+
+def make_config_dir(path, name, word):
+    path.mkdir()
+    (path / "config.yaml").write_text(f"user-agent: {name}\ndb: trackthenews.db\n")
+    (path / "matchlist.txt").write_text(word + "\n")
+    (path / "matchlist_case_sensitive.txt").write_text("")
+    (path / "rssfeeds.json").write_text(
+        json.dumps([{"outlet": name, "url": "https://example.com/feed"}])
+    )
+    return core.Bot(str(path))
+
+
+@pytest.fixture(autouse=True)
+def module_state(monkeypatch):
+    for name in ("home", "config", "ua", "matcher", "blocklist_loaded", "image_cache"):
+        monkeypatch.setattr(core, name, None, raising=False)
+    monkeypatch.setattr(core.time, "sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    posted = []
+
+    def tweet(self):
+        posted.append((core.config["user-agent"], self.outlet, self.url))
+        self.tweeted = True
+
+    monkeypatch.setattr(core.Article, "tweet", tweet)
+    monkeypatch.setattr(core.Article, "toot", lambda self: None)
+    return posted
+
+
+def test_extraction_cache_extracts_each_article_once(http_session):
+    extractions = core.ExtractionCache()
+
+    first = extractions.get("https://example.com/records", http_session)
+    assert extractions.get("https://example.com/records", http_session) is first
+
+    for _ in range(2):
+        with pytest.raises(requests.HTTPError):
+            extractions.get("https://example.com/gone", http_session)
+
+    assert http_session.requested == ["https://example.com/records", "https://example.com/gone"]
+
+
+def test_bots_share_fetches_but_match_and_post_separately(tmp_path, posted, http_session):
+    bots = [
+        make_config_dir(tmp_path / "records", "Records Bot", "public records"),
+        make_config_dir(tmp_path / "weather", "Weather Bot", "rain"),
+    ]
+    for bot in bots:
+        bot.setup()
+
+    core.poll_shared_feeds(bots, http_session)
+
+    assert http_session.requested == [
+        "https://example.com/feed",
+        "https://example.com/records",
+        "https://example.com/weather",
+        "https://example.com/gone",
+    ]
+    # Each bot posts its own matches, under its own configuration.
+    assert posted == [
+        ("Records Bot", "Records Bot", "https://example.com/records"),
+        ("Weather Bot", "Weather Bot", "https://example.com/weather"),
+    ]
+
+    for bot in bots:
+        bot.close()
+        conn = sqlite3.connect(f"{bot.home}/trackthenews.db")
+        assert sorted(conn.execute("select url, tweeted from articles")) == [
+            ("https://example.com/gone", 0),
+            ("https://example.com/records", int(bot.home.endswith("records"))),
+            ("https://example.com/weather", int(bot.home.endswith("weather"))),
+        ]
@@ -0,0 +1,76 @@
+"""
+Tests for the streaming feed -> dedup -> check -> record pipeline.
+"""
+
+import pytest
+
+from trackthenews import core
+from trackthenews.matcher import Matcher
+
+FEED = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Example</title>
+<item><title>First</title><link>https://example.com/first?utm_source=rss</link></item>
+<item><title>Untitled</title></item>
+<item><title>First again</title><link>https://example.com/first</link></item>
+<item><title>Second</title><link>https://example.com/second</link></item>
+</channel></rss>
+"""
+
+
+@pytest.fixture(autouse=True)
+def matcher(monkeypatch):
+    monkeypatch.setattr(core, "matcher", Matcher(["public records"], []), raising=False)
+
+
+@pytest.fixture
+def http_session(http_session):
+    http_session.feed = FEED
+    return http_session
+
+
+def test_articles_have_no_instance_dict():
+    article = core.Article("Example", "Title", "https://example.com/")
+
+    assert not hasattr(article, "__dict__")
+
+
+def test_check_for_matches_releases_the_page_once_matching_is_done(http_session):
+    article = core.Article("Example", "Title", "https://example.com/first")
+    seen_by_blocklist = []
+
+    class Blocklist:
+        def check_article(self, article):
+            seen_by_blocklist.append(article.res.text)
+            return False
+
+        def check_paragraph(self, article, paragraph):
+            return False
+
+    article.check_for_matches(http_session, blocklist=Blocklist())
+
+    assert seen_by_blocklist == [http_session.page]
+    assert article.matching_grafs == [
+        "The newspaper obtained the emails through a public records request filed last year."
+    ]
+    assert article.res is None
+    assert article.plaintext is None
+
+
+def test_pipeline_checks_each_new_url_once(conn, seen_filter, http_session):
+    articles = core.parse_feed("Example", "https://example.com/feed", False, False, http_session)
+    articles = core.unseen_articles(articles, conn, seen_filter)
+    articles = core.checked_articles(articles, http_session)
+
+    recorded = []
+    for article in articles:
+        core.record_article(conn, seen_filter, article)
+        recorded.append((article.url, bool(article.matching_grafs)))
+
+    # The duplicate entry is only seen as a duplicate because the first one was
+    # recorded before the feed's next entry was pulled through the pipeline.
+    assert recorded == [("https://example.com/first", True), ("https://example.com/second", True)]
+    assert http_session.requested == [
+        "https://example.com/feed",
+        "https://example.com/first",
+        "https://example.com/second",
+    ]
@@ -0,0 +1,131 @@
+"""
+Tests for the per-host circuit breaker and the retry queue for failed fetches.
+"""
+
+import datetime
+
+import pytest
+import requests
+
+from trackthenews import core
+from trackthenews.breaker import CircuitBreaker, HostUnavailable, is_transient
+
+
+class DeadSession:
+    def __init__(self):
+        self.requested = []
+
+    def get(self, url, timeout):
+        self.requested.append(url)
+        raise requests.ConnectionError(f"can't reach {url}")
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    config = {"retry_attempts": 3}
+    monkeypatch.setattr(core, "config", config, raising=False)
+    monkeypatch.setattr(core.time, "sleep", lambda seconds: None)
+    return config
+
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+def test_is_transient():
+    assert is_transient(requests.ConnectionError())
+    assert is_transient(requests.Timeout())
+    assert is_transient(http_error(503))
+    assert is_transient(http_error(429))
+    assert not is_transient(http_error(404))
+    assert not is_transient(ValueError("a blocklist bug"))
+
+
+def test_breaker_stops_requests_to_a_failing_host():
+    session = DeadSession()
+    articles = [
+        core.Article("Down", f"Story {i}", f"https://down.example/{i}") for i in range(5)
+    ] + [core.Article("Up", "Story", "https://up.example/1")]
+
+    checked = list(core.checked_articles(articles, session, breaker=CircuitBreaker(2)))
+
+    assert session.requested == [
+        "https://down.example/0",
+        "https://down.example/1",
+        "https://up.example/1",
+    ]
+    assert [type(article.error) for article in checked] == [
+        requests.ConnectionError,
+        requests.ConnectionError,
+        HostUnavailable,
+        HostUnavailable,
+        HostUnavailable,
+        requests.ConnectionError,
+    ]
+
+
+def test_failed_articles_are_deferred_instead_of_recorded(conn, seen_filter):
+    article = core.Article("Down", "Story", "https://down.example/story")
+
+    core.process_articles([article], conn, seen_filter, DeadSession())
+
+    assert conn.execute("select count(*) from articles").fetchone() == (0,)
+    assert conn.execute("select attempts, last_error from retries").fetchall() == [
+        (1, "can't reach https://down.example/story")
+    ]
+    # Still pending, so a feed serving it again doesn't queue it a second time...
+    assert core.url_seen(conn, seen_filter, article.url)
+    # ...and it isn't due again until the backoff has passed.
+    assert core.due_retries(conn) == []
+
+
+def test_retries_back_off_exponentially_then_give_up(conn, seen_filter):
+    article = core.Article("Down", "Story", "https://down.example/story")
+    delays = []
+
+    for _ in range(2):
+        before = datetime.datetime.now(tz=datetime.UTC)
+        article.error = requests.ConnectionError()
+        core.defer_article(conn, seen_filter, article)
+        (next_attempt,) = conn.execute("select next_attempt from retries").fetchone()
+        delays.append(datetime.datetime.fromisoformat(next_attempt) - before)
+
+    assert core.RETRY_BASE_DELAY <= delays[0] < core.RETRY_BASE_DELAY * 2
+    assert core.RETRY_BASE_DELAY * 2 <= delays[1] < core.RETRY_BASE_DELAY * 4
+
+    core.defer_article(conn, seen_filter, article)
+
+    assert conn.execute("select count(*) from retries").fetchone() == (0,)
+    assert conn.execute("select url from articles").fetchall() == [(article.url,)]
+
+
+def test_articles_skipped_by_an_open_circuit_keep_their_attempts(conn, seen_filter):
+    article = core.Article("Down", "Story", "https://down.example/story")
+    article.error = requests.ConnectionError()
+    core.defer_article(conn, seen_filter, article)
+
+    # However long the host stays down, being skipped never gives up on it.
+    for _ in range(10):
+        article.error = HostUnavailable("down.example has failed 3 times this run")
+        assert not core.defer_article(conn, seen_filter, article)
+
+    assert conn.execute("select attempts from retries").fetchall() == [(1,)]
+    assert conn.execute("select count(*) from articles").fetchone() == (0,)
+
+
+def test_due_retries_are_recorded_once_they_succeed(conn, seen_filter):
+    article = core.Article("Down", "Story", "https://down.example/story")
+    article.error = requests.ConnectionError()
+    core.defer_article(conn, seen_filter, article)
+    conn.execute("update retries set next_attempt = '2000-01-01 00:00:00+00:00'")
+
+    (retry,) = core.due_retries(conn)
+    assert (retry.outlet, retry.title, retry.url) == ("Down", "Story", article.url)
+
+    retry.error = None
+    core.record_article(conn, seen_filter, retry)
+
+    assert conn.execute("select count(*) from retries").fetchone() == (0,)
+    assert conn.execute("select url from articles").fetchall() == [(article.url,)]
@@ -0,0 +1,89 @@
+"""
+Tests for seen-URL deduplication: the Bloom filter in front of the database and
+the retention policy that archives old articles.
+"""
+
+import datetime
+import sqlite3
+
+from trackthenews import core
+from trackthenews.bloom import BloomFilter, url_digest
+
+
+def record(conn, url, recorded_at):
+    conn.execute(
+        "insert into articles(title, outlet, url, tweeted, tooted, recorded_at)"
+        " values ('', '', ?, 0, 0, ?)",
+        (url, recorded_at.isoformat(" ")),
+    )
+    conn.commit()
+
+
+def test_bloom_filter_round_trips_through_a_file(tmp_path):
+    bloom = BloomFilter(1000)
+    bloom.add(url_digest("https://example.com/a"))
+    bloom.last_article_id = 7
+    bloom.save(str(tmp_path / "seen.bloom"))
+
+    loaded = BloomFilter.load(str(tmp_path / "seen.bloom"))
+
+    assert url_digest("https://example.com/a") in loaded
+    assert url_digest("https://example.com/b") not in loaded
+    assert (loaded.count, loaded.capacity, loaded.last_article_id) == (1, 1000, 7)
+
+
+def test_bloom_filter_load_rejects_garbage(tmp_path):
+    path = tmp_path / "seen.bloom"
+    path.write_bytes(b"not a filter")
+
+    assert BloomFilter.load(str(path)) is None
+    assert BloomFilter.load(str(tmp_path / "missing.bloom")) is None
+
+
+def test_load_seen_filter_catches_up_on_rows_recorded_after_it_was_saved(tmp_path, conn):
+    now = datetime.datetime.now(tz=datetime.UTC)
+    path = str(tmp_path / core.SEEN_FILTER_FILENAME)
+    record(conn, "https://example.com/first", now)
+    core.load_seen_filter(conn, path).save(path)
+
+    record(conn, "https://example.com/second", now)
+    seen_filter = core.load_seen_filter(conn, path)
+
+    assert core.url_seen(conn, seen_filter, "https://example.com/first")
+    assert core.url_seen(conn, seen_filter, "https://example.com/second")
+    assert not core.url_seen(conn, seen_filter, "https://example.com/third")
+
+
+def test_pruned_articles_are_still_seen(tmp_path, conn):
+    now = datetime.datetime.now(tz=datetime.UTC)
+    record(conn, "https://example.com/old", now - datetime.timedelta(days=90))
+    record(conn, "https://example.com/new", now)
+
+    assert core.prune_articles(conn, retention_days=30) == 1
+
+    urls = [url for (url,) in conn.execute("select url from articles")]
+    assert urls == ["https://example.com/new"]
+
+    # Rebuilt from scratch, the filter has to learn about archived URLs from seen_urls.
+    seen_filter = core.load_seen_filter(conn, str(tmp_path / core.SEEN_FILTER_FILENAME))
+    assert core.url_seen(conn, seen_filter, "https://example.com/old")
+    assert core.url_seen(conn, seen_filter, "https://example.com/new")
+
+
+def test_prune_articles_keeps_the_newest_row(conn):
+    record(conn, "https://example.com/only", datetime.datetime(2001, 1, 1, tzinfo=datetime.UTC))
+
+    assert core.prune_articles(conn, retention_days=30) == 0
+
+
+def test_apply_migrations_adds_the_index_and_archive_table():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "create table articles (id integer primary key not null, title text, outlet text,"
+        " url text, tweeted boolean, recorded_at datetime)"
+    )
+
+    core.apply_migrations(conn)
+
+    assert [row[1] for row in conn.execute("PRAGMA index_list(articles)")] == ["articles_url"]
+    assert conn.execute("select count(*) from seen_urls").fetchone() == (0,)
@@ -0,0 +1,312 @@
+"""
+Tests for WebSub push ingestion, run against a local stand-in for a hub.
+"""
+
+import datetime
+import hashlib
+import hmac
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode
+
+import pytest
+import requests
+
+from trackthenews import core
+from trackthenews.matcher import Matcher
+from trackthenews.websub import (
+    RENEW_MARGIN_SECONDS,
+    WebSubListener,
+    callback_path,
+    discover_hub,
+)
+
+FEED = """<?xml version="1.0"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom"><channel><title>Example</title>
+<atom:link rel="hub" href="{hub}"/>
+<atom:link rel="self" href="{topic}"/>
+<item><title>Pushed story</title><link>{base}/story</link></item>
+</channel></rss>
+"""
+
+PAGE = """<html><body><article>
+<p>The newspaper obtained the emails through a public records request filed last year.</p>
+</article></body></html>
+"""
+
+
+class FakeHub:
+    """Serves a feed that advertises this hub, and acts as the hub for it."""
+
+    def __init__(self):
+        hub = self
+        self.subscriptions = {}
+        self.verified = threading.Event()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = (PAGE if self.path == "/story" else hub.feed()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                form = {key: values[0] for key, values in form.items()}
+                hub.subscriptions[form["hub.topic"]] = form
+                self.send_response(202)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                # Hubs verify asynchronously, after accepting the request.
+                threading.Thread(target=hub.verify, args=(form,)).start()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.hub_url = self.base + "/hub"
+        self.topic = self.base + "/feed"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def feed(self):
+        return FEED.format(hub=self.hub_url, topic=self.topic, base=self.base)
+
+    def verify(self, form):
+        params = {
+            "hub.mode": "subscribe",
+            "hub.topic": form["hub.topic"],
+            "hub.challenge": "challenge-accepted",
+            "hub.lease_seconds": "86400",
+        }
+        response = requests.get(form["hub.callback"] + "?" + urlencode(params), timeout=5)
+        if response.text == "challenge-accepted":
+            self.verified.set()
+
+    def publish(self, body, secret=None):
+        form = self.subscriptions[self.topic]
+        secret = secret or form["hub.secret"]
+        signature = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+        return requests.post(
+            form["hub.callback"],
+            data=body,
+            headers={"X-Hub-Signature": f"sha256={signature}"},
+            timeout=5,
+        )
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def hub():
+    hub = FakeHub()
+    yield hub
+    hub.close()
+
+
+@pytest.fixture
+def listener():
+    listener = WebSubListener("http://callback.invalid", port=0)
+    listener.callback_url = f"http://127.0.0.1:{listener.port}"
+    listener.start()
+    yield listener
+    listener.stop()
+
+
+@pytest.fixture
+def feed(hub):
+    return {"outlet": "Example", "url": hub.topic, "delicate": False, "redirects": False}
+
+
+def test_discover_hub_reads_the_feeds_own_links(hub):
+    assert discover_hub(hub.topic, requests.Session()) == (hub.hub_url, hub.topic)
+
+
+def test_subscription_is_verified_and_pushes_are_queued(hub, listener, feed):
+    assert listener.needs_subscription(feed["url"])
+
+    listener.subscribe(feed, requests.Session())
+
+    assert hub.verified.wait(5)
+    assert listener.is_subscribed(feed["url"])
+    assert not listener.needs_subscription(feed["url"])
+    assert hub.subscriptions[hub.topic]["hub.callback"] == (
+        listener.callback_url + callback_path(hub.topic)
+    )
+
+    body = hub.feed().encode("utf-8")
+    assert hub.publish(body).status_code == 202
+    assert listener.pushed.get(timeout=5) == (feed, body)
+
+
+def test_subscribed_feeds_are_polled_in_time_to_renew(hub, listener, feed):
+    listener.subscribe(feed, requests.Session())
+    assert hub.verified.wait(5)
+    subscription = listener.subscription_for_feed(feed["url"])
+
+    def delay():
+        return core.next_poll_delay(listener, feed["url"], 15 * 60, 6 * 60 * 60)
+
+    # A long lease leaves the fallback poll interval alone...
+    assert delay() == 6 * 60 * 60
+
+    # ...but a short one brings the next poll forward to its renewal...
+    subscription.expires_at = time.time() + RENEW_MARGIN_SECONDS + 2 * 60 * 60
+    assert 2 * 60 * 60 - 5 < delay() <= 2 * 60 * 60
+
+    # ...though never to sooner than feeds without a hub are polled.
+    subscription.expires_at = time.time() + RENEW_MARGIN_SECONDS
+    assert delay() == 15 * 60
+
+    subscription.expires_at = None
+    assert delay() == 15 * 60
+
+
+def test_pushes_with_a_bad_signature_are_acknowledged_and_dropped(hub, listener, feed):
+    listener.subscribe(feed, requests.Session())
+    assert hub.verified.wait(5)
+
+    assert hub.publish(b"<rss/>", secret="not-the-secret").status_code == 202
+    assert listener.pushed.empty()
+
+
+def test_unknown_callbacks_are_refused(listener):
+    callback = f"{listener.callback_url}/nope"
+
+    assert requests.get(callback, params={"hub.mode": "subscribe"}, timeout=5).status_code == 404
+    assert requests.post(callback, data=b"", timeout=5).status_code == 410
+
+
+def test_pushed_bodies_go_through_the_pipeline(monkeypatch, hub, conn, seen_filter):
+    monkeypatch.setattr(core, "config", {}, raising=False)
+    monkeypatch.setattr(core, "matcher", Matcher(["public records"], []), raising=False)
+    monkeypatch.setattr(core.time, "sleep", lambda seconds: None)
+    posted = []
+    monkeypatch.setattr(core.Article, "tweet", lambda self: posted.append(self.url))
+    monkeypatch.setattr(core.Article, "toot", lambda self: None)
+
+    # The feed URL itself is never fetched; only the article is.
+    feed = {
+        "outlet": "Example",
+        "url": "http://127.0.0.1:9/",
+        "delicate": False,
+        "redirects": False,
+    }
+    core.poll_feed(feed, conn, seen_filter, requests.Session(), body=hub.feed().encode("utf-8"))
+
+    assert posted == [hub.base + "/story"]
+    assert conn.execute("select url from articles").fetchall() == [(hub.base + "/story",)]
+
+
+def make_feeds(*names):
+    return [
+        {
+            "outlet": name,
+            "url": f"https://{name}.example/feed",
+            "delicate": False,
+            "redirects": False,
+        }
+        for name in names
+    ]
+
+
+@pytest.fixture
+def listen_config(monkeypatch):
+    config = {"websub": {"callback_url": "http://callback.invalid", "port": 0}}
+    monkeypatch.setattr(core, "config", config, raising=False)
+    monkeypatch.setattr(core, "ua", "test", raising=False)
+    monkeypatch.setattr(core.WebSubListener, "needs_subscription", lambda self, url: False)
+    return config
+
+
+@pytest.fixture
+def bot(tmp_path, conn, seen_filter):
+    bot = core.Bot(str(tmp_path))
+    bot.conn = conn
+    bot.seen_filter = seen_filter
+    bot.seen_filter_path = str(tmp_path / core.SEEN_FILTER_FILENAME)
+    return bot
+
+
+def test_listener_keeps_going_when_a_feed_fails(monkeypatch, bot, listen_config):
+    feeds = make_feeds("broken", "working")
+    artifact = types.SimpleNamespace(value={"rss_feeds": feeds}, refresh=lambda: False)
+
+    polled = []
+
+    def poll_feed(feed, *args, **kwargs):
+        polled.append(feed["url"])
+        if len(polled) == 1:
+            raise RuntimeError("429 Too Many Requests")
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(core, "poll_feed", poll_feed)
+
+    bot.artifact = artifact
+    core.listen(bot, requests.Session())
+
+    assert polled == [feed["url"] for feed in feeds]
+
+
+def test_removing_a_feed_while_listening_doesnt_stall_the_loop(monkeypatch, bot, listen_config):
+    listen_config["poll_interval_minutes"] = 0.005  # Every 0.3 seconds.
+    feeds = make_feeds("kept", "removed")
+    artifact = types.SimpleNamespace(value={"rss_feeds": feeds})
+    passes = []
+    start = time.monotonic()
+
+    def refresh():
+        passes.append(time.monotonic())
+        if len(passes) == 2:
+            artifact.value = {"rss_feeds": feeds[:1]}
+        if time.monotonic() - start > 1:
+            raise KeyboardInterrupt
+        return False
+
+    artifact.refresh = refresh
+    monkeypatch.setattr(core, "poll_feed", lambda feed, *args, **kwargs: None)
+
+    bot.artifact = artifact
+    core.listen(bot, requests.Session())
+
+    # One pass each time the remaining feed is due, not one after another.
+    assert len(passes) < 10
+
+
+def test_listener_maintains_the_database_while_running(monkeypatch, bot, listen_config, conn):
+    listen_config["retention_days"] = 30
+    monkeypatch.setattr(core, "MAINTENANCE_INTERVAL_HOURS", 0)
+    old = datetime.datetime.now(tz=datetime.UTC) - datetime.timedelta(days=60)
+    for i in range(3):
+        conn.execute(
+            "insert into articles(url, recorded_at) values (?, ?)",
+            (f"https://example.com/{i}", old.isoformat(" ")),
+        )
+    conn.commit()
+    full = core.BloomFilter(1)
+    full.add(b"a" * 16)
+    full.add(b"b" * 16)
+    bot.seen_filter = full
+
+    bot.artifact = types.SimpleNamespace(
+        value={"rss_feeds": make_feeds("only")}, refresh=lambda: False
+    )
+
+    def poll_feed(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(core, "poll_feed", poll_feed)
+
+    core.listen(bot, requests.Session())
+
+    # The newest row is always kept, so ids keep counting up.
+    assert conn.execute("select count(*) from articles").fetchone() == (1,)
+    assert conn.execute("select count(*) from seen_urls").fetchone() == (2,)
+    assert bot.seen_filter is not full
+    assert not bot.seen_filter.saturated
+    assert all(core.url_seen(conn, bot.seen_filter, f"https://example.com/{i}") for i in range(3))
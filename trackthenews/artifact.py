@@ -0,0 +1,91 @@
+import hashlib
+import os
+import pickle
+
+# Bump whenever the shape of what build() returns changes, so stale artifacts
+# written by an older version are rebuilt rather than unpickled.
+ARTIFACT_VERSION = 1
+
+
+def _file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class CachedArtifact:
+    """
+    A value built from a set of source files and cached on disk as a pickle.
+
+    Sources are keyed by mtime and size, which is cheap enough to check
+    often. When those change, the files are hashed, and the value is only
+    rebuilt if the contents actually differ.
+    """
+
+    def __init__(self, path, sources, build):
+        self.path = path
+        self.sources = sources
+        self.build = build
+        self.stamps = None
+        self.value = None
+
+    def _stat(self):
+        stats = {}
+        for source in self.sources:
+            try:
+                st = os.stat(source)
+            except FileNotFoundError:
+                stats[source] = None
+            else:
+                stats[source] = (st.st_mtime_ns, st.st_size)
+        return stats
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                version, stamps, value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+            return
+        if version == ARTIFACT_VERSION:
+            self.stamps, self.value = stamps, value
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((ARTIFACT_VERSION, self.stamps, self.value), f)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """
+        Bring the value up to date with its sources.
+
+        Returns True if the value was (re)loaded or rebuilt, and False if it was
+        already current. Errors raised by build() propagate, and leave the
+        previous value in place.
+        """
+        changed = self.value is None
+        if self.value is None:
+            self._load()
+
+        stats = self._stat()
+        old = self.stamps or {}
+        if self.stamps is not None and all(
+            (old[source][:2] if old.get(source) else None) == stats[source]
+            for source in self.sources
+        ):
+            return changed
+
+        stamps = {
+            source: (*stats[source], _file_hash(source)) if stats[source] else None
+            for source in self.sources
+        }
+        if self.stamps is None or any(
+            (old[source][2] if old.get(source) else None)
+            != (stamps[source][2] if stamps[source] else None)
+            for source in self.sources
+        ):
+            self.value = self.build()
+            changed = True
+
+        self.stamps = stamps
+        self._save()
+        return changed
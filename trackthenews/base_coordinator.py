@@ -0,0 +1,21 @@
+from abc import ABC, abstractmethod
+
+
+class BaseCoordinator(ABC):
+    """Abstract base class for coordinating several workers sharing one feed list."""
+
+    @abstractmethod
+    def acquire_feed(self, feed_url):
+        """Take ownership of a feed for polling, returning False if another worker owns it."""
+
+    @abstractmethod
+    def release_feed(self, feed_url):
+        """Give up ownership of a feed once it has been polled."""
+
+    @abstractmethod
+    def claim_article(self, url):
+        """Claim an article for checking, returning False if it was seen or is claimed already."""
+
+    @abstractmethod
+    def release_article(self, url, recorded):
+        """Release a claimed article, noting whether it was recorded as seen or deferred."""
@@ -0,0 +1,102 @@
+import hashlib
+import math
+import os
+import struct
+
+# Header: magic, format version, bit count, hash count, capacity, items added,
+# and the highest articles.id folded in, so a loaded filter knows which rows to
+# catch up on.
+_MAGIC = b"TTNB"
+_HEADER = struct.Struct("<4sBQBQQQ")
+_VERSION = 1
+
+
+def url_digest(url):
+    """Return the 16-byte digest used to key a URL in the filter and the archive."""
+    return hashlib.sha256(url.encode("utf-8")).digest()[:16]
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter over URL digests.
+
+    A miss means the URL has definitely never been added; a hit only means it
+    probably has, and the caller has to confirm against the database.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_bits = max(num_bits, 8)
+        self.num_hashes = max(round(self.num_bits / capacity * math.log(2)), 1)
+        self.capacity = capacity
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self.last_article_id = 0
+
+    def _positions(self, digest):
+        # Kirsch-Mitzenmacher double hashing over the two halves of the digest.
+        h1, h2 = struct.unpack("<QQ", digest)
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+    def add(self, digest):
+        # Only count digests that weren't (probably) there already, so that
+        # adding the same URL twice doesn't use up capacity.
+        if digest in self:
+            return
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+    @property
+    def saturated(self):
+        """True once more items have been added than the filter was sized for."""
+        return self.count > self.capacity
+
+    def save(self, path):
+        """Write the filter to path atomically."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    _VERSION,
+                    self.num_bits,
+                    self.num_hashes,
+                    self.capacity,
+                    self.count,
+                    self.last_article_id,
+                )
+            )
+            f.write(self.bits)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a filter written by save(), or return None if it is missing or unreadable."""
+        try:
+            with open(path, "rb") as f:
+                header = f.read(_HEADER.size)
+                bits = bytearray(f.read())
+        except OSError:
+            return None
+
+        if len(header) != _HEADER.size:
+            return None
+        magic, version, num_bits, num_hashes, capacity, count, last_article_id = _HEADER.unpack(
+            header
+        )
+        if magic != _MAGIC or version != _VERSION or len(bits) != (num_bits + 7) // 8:
+            return None
+
+        bloom = cls.__new__(cls)
+        bloom.num_bits = num_bits
+        bloom.num_hashes = num_hashes
+        bloom.capacity = capacity
+        bloom.bits = bits
+        bloom.count = count
+        bloom.last_article_id = last_article_id
+        return bloom
@@ -0,0 +1,48 @@
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import requests
+
+
+class HostUnavailable(Exception):
+    """Raised in place of a request to a host whose circuit is open."""
+
+
+def is_transient(exc):
+    """Return whether a failed request is worth trying again later."""
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, HostUnavailable)):
+        return True
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """
+    Tracks failing hosts over the course of a run.
+
+    Once requests for threshold different URLs on a host have failed, its
+    circuit opens and check() raises HostUnavailable for it until the run
+    ends, instead of letting each remaining request to it wait out the full
+    timeout. Failures are counted by URL, so one failed download reported by
+    several bots only counts once.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.failures = defaultdict(set)
+
+    @staticmethod
+    def host(url):
+        return urlsplit(url).hostname or ""
+
+    def check(self, url):
+        host = self.host(url)
+        if len(self.failures[host]) >= self.threshold:
+            raise HostUnavailable(f"{host} has failed {len(self.failures[host])} times this run")
+
+    def record_failure(self, url):
+        host = self.host(url)
+        self.failures[host].add(url)
+        if len(self.failures[host]) == self.threshold:
+            print(f"Giving up on {host} for the rest of this run.")
@@ -4,12 +4,16 @@
 
 import argparse
 import datetime
+import importlib.util
 import json
 import os
+import queue
+import socket
 import sqlite3
 import sys
 import textwrap
 import time
+import zlib
 from collections.abc import Iterable
 from io import BytesIO
 from typing import IO
@@ -23,6 +27,14 @@ from mastodon import Mastodon, MastodonError, MastodonNetworkError
 from PIL import Image, ImageDraw, ImageFont
 from readability import Document
 
+from .artifact import CachedArtifact
+from .base_coordinator import BaseCoordinator
+from .bloom import BloomFilter, url_digest
+from .breaker import CircuitBreaker, HostUnavailable, is_transient
+from .image_cache import ImageCache, image_key
+from .matcher import Matcher
+from .websub import WebSubListener
+
 # TODO: add/remove RSS feeds from within the script.
 # Currently the matchwords list and RSS feeds list must be edited separately.
 # TODO: add support for additional parsers beyond readability
@@ -41,9 +53,74 @@ HTTP_TIMEOUT_SECONDS = 30
 IMAGE_FORMAT = "jpeg"
 IMAGE_FILENAME = f"image.{IMAGE_FORMAT}"
 IMAGE_MIME_TYPE = f"image/{IMAGE_FORMAT}"
+IMAGE_QUALITY = 95
+
+# Encoded excerpt images are cached in IMAGE_CACHE_DIRNAME, keyed by everything
+# they're rendered from, so a paragraph that matches again (in another outlet's
+# copy of a wire story, or on a retry) isn't laid out and encoded again. The
+# cache is capped at image_cache_mb from the config, or IMAGE_CACHE_MB.
+IMAGE_CACHE_DIRNAME = "image-cache"
+IMAGE_CACHE_MB = 100
+image_cache = None
+
+# Seen URLs are fronted by a Bloom filter persisted next to the database, so
+# most dedup checks for new articles never reach SQLite.
+SEEN_FILTER_FILENAME = "seen-urls.bloom"
+SEEN_FILTER_MIN_CAPACITY = 100_000
+
+# The parsed config, normalized feed list and compiled matcher are cached here,
+# and only rebuilt when one of the files they come from changes.
+COMPILED_FILENAME = "compiled.pickle"
+
+# A host that fails this many times in a run isn't contacted again until the
+# next one. Articles that fail for transient reasons are retried with
+# exponential backoff, starting from RETRY_BASE_DELAY, and are only recorded as
+# seen once they succeed or have been attempted RETRY_ATTEMPTS times.
+CIRCUIT_BREAKER_THRESHOLD = 3
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = datetime.timedelta(minutes=15)
+
+# When running with --listen, feeds are polled this often, except for feeds
+# that push their updates to us over WebSub, which are only polled as a
+# fallback, every WEBSUB_POLL_INTERVAL_MINUTES.
+POLL_INTERVAL_MINUTES = 15
+WEBSUB_POLL_INTERVAL_MINUTES = 6 * 60
+
+# Archiving old articles and rebuilding a full seen filter happen at the start
+# of every run, and with --listen, again every MAINTENANCE_INTERVAL_HOURS.
+MAINTENANCE_INTERVAL_HOURS = 24
+
+# Workers sharing a database own a feed for LEASE_MINUTES at a time while
+# polling it, and an article for as long while checking and posting it, so a
+# worker that dies mid-feed only holds them up for that long.
+LEASE_MINUTES = 10
+
+# With digest mode on, matches are queued instead of posted one by one, and
+# once the oldest has waited digest.window_minutes (DIGEST_WINDOW_MINUTES by
+# default) they're all posted together: in one status if they fit, or else in
+# a thread. Each status carries the first excerpt of up to four of its
+# articles, rather than up to four excerpts of every article.
+DIGEST_WINDOW_MINUTES = 30
+TWITTER_MAX_CHARS = 280
+MASTODON_MAX_CHARS = 500
 
 
 class Article:
+    # Articles are created for every feed entry, so keep them compact.
+    __slots__ = (
+        "delicate",
+        "error",
+        "matching_grafs",
+        "outlet",
+        "plaintext",
+        "redirects",
+        "res",
+        "title",
+        "tooted",
+        "tweeted",
+        "url",
+    )
+
     def __init__(self, outlet, title, url, delicate=False, redirects=False):
         self.outlet = outlet
         self.title = title
@@ -55,6 +132,10 @@ class Article:
         self.tweeted = False
         self.tooted = False
 
+        self.res = None
+        self.plaintext = None
+        self.error = None
+
     def canonicalize_url(self, http_session):
         """Process article URL to produce something roughly canonical."""
         # These outlets use redirect links in their RSS feeds.
@@ -68,47 +149,46 @@ class Article:
         if not self.delicate:
             self.url = decruft_url(self.url)
 
-    def clean(self, http_session):
-        """Download the article and strip it of HTML formatting."""
-        self.res = http_session.get(self.url, timeout=HTTP_TIMEOUT_SECONDS)
-        self.res.raise_for_status()
-        doc = Document(self.res.text)
-
-        h = html2text.HTML2Text()
-        h.ignore_links = True
-        h.ignore_emphasis = True
-        h.ignore_images = True
-        h.body_width = 0
+    def clean(self, http_session, extractions=None):
+        """
+        Download the article and strip it of HTML formatting.
 
-        self.plaintext = h.handle(doc.summary())
+        Given an ExtractionCache, an article another bot has just cleaned is
+        taken from there rather than downloaded again.
+        """
+        if extractions is None:
+            self.res, self.plaintext = extract_article(self.url, http_session)
+        else:
+            self.res, self.plaintext = extractions.get(self.url, http_session)
 
-    def check_for_matches(self, http_session, blocklist=None):
+    def check_for_matches(self, http_session, blocklist=None, extractions=None):
         """
         Clean up an article, check it against a block list, then for matches.
+
+        The downloaded page and its plaintext are only kept for as long as the
+        blocklist might need them, and are released once matching is done.
         """
-        self.clean(http_session)
-        plaintext_grafs = self.plaintext.split("\n")
+        try:
+            self.clean(http_session, extractions=extractions)
+            plaintext_grafs = self.plaintext.split("\n")
 
-        if blocklist and blocklist.check_article(self):
-            pass
-        else:
-            for graf in plaintext_grafs:
-                if any(word.lower() in graf.lower() for word in matchwords) or any(
-                    word in graf for word in matchwords_case_sensitive
-                ):
-                    if blocklist and blocklist.check_paragraph(self, graf):
-                        continue
-                    self.matching_grafs.append(graf)
+            if blocklist and blocklist.check_article(self):
+                pass
+            else:
+                for graf in plaintext_grafs:
+                    if matcher.matches(graf):
+                        if blocklist and blocklist.check_paragraph(self, graf):
+                            continue
+                        self.matching_grafs.append(graf)
+        finally:
+            self.res = None
+            self.plaintext = None
 
     def prepare_images(self, square):
         """Prepares the images for upload."""
         img_files = []
         for graf in self.matching_grafs[:4]:
-            img = render_img(graf, square=square)
-            img_io = BytesIO()
-            img.save(img_io, format=IMAGE_FORMAT, quality=95)
-            img_io.seek(0)
-            img_files.append(img_io)
+            img_files.append(BytesIO(render_img_bytes(graf, square=square)))
 
         return img_files
 
@@ -145,8 +225,7 @@ class Article:
 
         source = self.outlet + ": " if self.outlet else ""
 
-        # Tweets can be 280 characters
-        title = self.truncate_title(280, source)
+        title = self.truncate_title(TWITTER_MAX_CHARS, source)
 
         content = f"{source}{title} {self.url}"
 
@@ -178,8 +257,7 @@ class Article:
 
         source = self.outlet + ": " if self.outlet else ""
 
-        # Toots can be 500 characters
-        title = self.truncate_title(500, source)
+        title = self.truncate_title(MASTODON_MAX_CHARS, source)
 
         status = f"{source}{title} {self.url}"
 
@@ -188,12 +266,66 @@ class Article:
         self.tooted = True
 
 
+def extract_article(url, http_session):
+    """Download an article and return the response and its readable text."""
+    res = http_session.get(url, timeout=HTTP_TIMEOUT_SECONDS)
+    res.raise_for_status()
+    doc = Document(res.text)
+
+    h = html2text.HTML2Text()
+    h.ignore_links = True
+    h.ignore_emphasis = True
+    h.ignore_images = True
+    h.body_width = 0
+
+    return res, h.handle(doc.summary())
+
+
+class ExtractionCache:
+    """
+    Holds on to the most recently extracted article.
+
+    When several bots follow the same feed, they check each of its articles
+    one after another, so remembering a single article is enough for it to
+    be downloaded and run through readability only once. Failures are
+    remembered too, so a dead link isn't retried by every bot.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.url = None
+        self.result = None
+        self.error = None
+        self.fetched = False
+
+    def get(self, url, http_session):
+        if url != self.url:
+            self.clear()
+            self.url = url
+            self.fetched = True
+            try:
+                self.result = extract_article(url, http_session)
+            except Exception as e:  # noqa: BLE001 - re-raised below, for every bot that asks
+                self.error = e
+        if self.error:
+            raise self.error
+        return self.result
+
+
 def get_mastodon_instance():
     """Return an authenticated Mastodon instance."""
     api_base_url = config["mastodon"]["api_base_url"]
     access_token = config["mastodon"]["access_token"]
 
-    return Mastodon(access_token=access_token, api_base_url=api_base_url)
+    # In digest mode, spread requests out over what's left of the rate limit
+    # window, as reported by the server's headers, instead of running into it.
+    ratelimit_method = "pace" if config.get("digest") else "wait"
+
+    return Mastodon(
+        access_token=access_token, api_base_url=api_base_url, ratelimit_method=ratelimit_method
+    )
 
 
 def get_twitter_client():
@@ -208,6 +340,7 @@ def get_twitter_client():
         consumer_secret=app_secret,
         access_token=oauth_token,
         access_token_secret=oauth_token_secret,
+        wait_on_rate_limit=bool(config.get("digest")),
     )
 
 
@@ -224,7 +357,7 @@ def get_twitter_client_v1():
 
     tweepy_auth = tweepy.OAuth1UserHandler(app_key, app_secret, oauth_token, oauth_token_secret)
 
-    return tweepy.API(tweepy_auth)
+    return tweepy.API(tweepy_auth, wait_on_rate_limit=bool(config.get("digest")))
 
 
 def upload_twitter_images(img_files: Iterable[IO]) -> list[tweepy.models.Media]:
@@ -243,6 +376,91 @@ def upload_twitter_images(img_files: Iterable[IO]) -> list[tweepy.models.Media]:
     return media
 
 
+def digest_statuses(articles, max_chars, link_characters=23):
+    """
+    Pack a digest of articles into as few statuses of max_chars as they fit in.
+
+    Returns a list of (text, articles) pairs, one per status, in order.
+    """
+    header = f"{len(articles)} new matches:"
+    statuses = []
+    lines, listed, length = [header], [], len(header)
+
+    for article in articles:
+        source = article.outlet + ": " if article.outlet else ""
+        # Leave room for the header, so that every line fits in any status.
+        title = article.truncate_title(max_chars - len(header) - 1, source, link_characters)
+        line_length = len(source) + len(title) + 1 + link_characters
+
+        if listed and length + 1 + line_length > max_chars:
+            statuses.append(("\n".join(lines), listed))
+            lines, listed, length = [], [], -1
+
+        lines.append(f"{source}{title} {article.url}")
+        listed.append(article)
+        length += 1 + line_length
+
+    statuses.append(("\n".join(lines), listed))
+    return statuses
+
+
+def digest_images(articles):
+    """Return the excerpts a digest status carries: the first of each of up to four articles."""
+    grafs = [article.matching_grafs[0] for article in articles[:4]]
+    square = len(grafs) != 1
+    return grafs, [BytesIO(render_img_bytes(graf, square=square)) for graf in grafs]
+
+
+def tweet_digest(articles):
+    """Tweet a digest of articles, threading it if it takes more than one tweet."""
+    if "twitter" not in config:
+        print("Twitter is not configured. Skipping tweet.")
+        return
+
+    twitter = get_twitter_client()
+    reply_to = None
+
+    for text, listed in digest_statuses(articles, TWITTER_MAX_CHARS):
+        _, img_files = digest_images(listed)
+        media_ids = [m.media_id for m in upload_twitter_images(img_files)]
+
+        response = twitter.create_tweet(
+            text=text, media_ids=media_ids, in_reply_to_tweet_id=reply_to
+        )
+        reply_to = response.data["id"]
+
+        for article in listed:
+            article.tweeted = True
+
+
+def toot_digest(articles):
+    """Toot a digest of articles, threading it if it takes more than one toot."""
+    if "mastodon" not in config:
+        print("Mastodon is not configured. Skipping toot.")
+        return
+
+    mastodon = get_mastodon_instance()
+    reply_to = None
+
+    for text, listed in digest_statuses(articles, MASTODON_MAX_CHARS):
+        grafs, img_files = digest_images(listed)
+        media_ids = []
+
+        for article, graf, img_file in zip(listed, grafs, img_files, strict=False):
+            try:
+                alt_text = article.truncate_alt_text(graf)
+                res = mastodon.media_post(img_file, mime_type=IMAGE_MIME_TYPE, description=alt_text)
+                media_ids.append(res["id"])
+            except MastodonError:
+                pass
+
+        status = mastodon.status_post(status=text, media_ids=media_ids, in_reply_to_id=reply_to)
+        reply_to = status["id"]
+
+        for article in listed:
+            article.tooted = True
+
+
 def get_textsize(wrapped_graf, fnt, spacing):
     """Take wrapped text and additional parameters and return the expected rendered size."""
     im = Image.new(mode="RGB", size=(0, 0))
@@ -257,6 +475,28 @@ def get_textsize(wrapped_graf, fnt, spacing):
     return width, height + descent
 
 
+def render_img_bytes(graf, width=60, square=False):
+    """Return a paragraph rendered by render_img() and encoded, from the cache if possible."""
+    key = None
+    if image_cache:
+        key = image_key(
+            graf, config["font"], config["color"], width, square, IMAGE_FORMAT, IMAGE_QUALITY
+        )
+        data = image_cache.get(key)
+        if data is not None:
+            return data
+
+    img_io = BytesIO()
+    render_img(graf, width=width, square=square).save(
+        img_io, format=IMAGE_FORMAT, quality=IMAGE_QUALITY
+    )
+    data = img_io.getvalue()
+
+    if image_cache:
+        image_cache.put(key, data)
+    return data
+
+
 def render_img(graf, width=60, square=False):
     """Take a paragraph and render an Image of it on a plain background."""
     font_name = config["font"]
@@ -298,15 +538,27 @@ def decruft_url(url):
     return url
 
 
-def parse_feed(outlet, url, delicate, redirects, http_session):
-    """Take the URL of an RSS feed and return a list of Article objects."""
-    response = http_session.get(url, timeout=HTTP_TIMEOUT_SECONDS)
-    response.raise_for_status()
-    feed = feedparser.parse(response.text)
+def parse_feed(outlet, url, delicate, redirects, http_session, body=None):
+    """
+    Take the URL of an RSS feed and return an iterator of Article objects.
+
+    The feed itself is fetched right away, so HTTP errors are raised here, but
+    articles are only created (and their URLs canonicalized) as the iterator
+    is consumed. If the feed's body is given, as when a hub pushes it to us,
+    it is parsed instead of fetching url.
+    """
+    if body is None:
+        response = http_session.get(url, timeout=HTTP_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        body = response.text
+    entries = feedparser.parse(body)["entries"]
+
+    return iter_articles(outlet, entries, delicate, redirects, http_session)
 
-    articles = []
 
-    for entry in feed["entries"]:
+def iter_articles(outlet, entries, delicate, redirects, http_session):
+    """Yield an Article for each parsed feed entry."""
+    for entry in entries:
         """If for some reason the entry is missing a title or URL, just leave them empty."""
         title = entry.get("title", "")
         url = entry.get("link", "")
@@ -316,11 +568,513 @@ def parse_feed(outlet, url, delicate, redirects, http_session):
             continue
 
         article = Article(outlet, title, url, delicate, redirects)
-        article.canonicalize_url(http_session)
+        try:
+            article.canonicalize_url(http_session)
+        except requests.RequestException as e:
+            print(f"Unable to canonicalize {url}: {e}. Skipping for now.")
+            continue
+
+        yield article
+
+
+def unseen_articles(articles, conn, seen_filter):
+    """Yield only the articles that haven't been recorded before."""
+    for article in articles:
+        if not url_seen(conn, seen_filter, article.url):
+            yield article
+
 
+def checked_articles(articles, http_session, blocklist=None, breaker=None, extractions=None):
+    """
+    Download each article and check it for matches, yielding it once checked.
+
+    Articles that couldn't be checked for a reason that may clear up on its
+    own are yielded with the exception set as their error.
+    """
+    for counter, article in enumerate(articles, 1):
+        print(f"Checking {article.outlet} article {counter}")
+
+        try:
+            if breaker:
+                breaker.check(article.url)
+            article.check_for_matches(http_session, blocklist=blocklist, extractions=extractions)
+        except Exception as e:  # noqa: BLE001 - can raise from requests, parsing, or user blocklist code
+            print(e)
+            if is_transient(e):
+                article.error = e
+                if breaker and not isinstance(e, HostUnavailable):
+                    breaker.record_failure(article.url)
+                print("Having trouble with that article. Will try again later.")
+            else:
+                print("Having trouble with that article. Skipping for now.")
+
+        yield article
+
+
+def record_article(conn, seen_filter, article):
+    """Record an article as seen, so it is never checked or posted again."""
+    conn.execute(
+        """insert into articles(
+                 title, outlet, url, tweeted, tooted, recorded_at)
+                 values (?, ?, ?, ?, ?, ?)""",
+        (
+            article.title,
+            article.outlet,
+            article.url,
+            article.tweeted,
+            article.tooted,
+            datetime.datetime.now(tz=datetime.UTC),
+        ),
+    )
+
+    conn.execute("delete from retries where url = ?", (article.url,))
+
+    conn.commit()
+
+    # The filter's last_article_id is left alone: other workers may have
+    # recorded articles in between, which save_seen_filter() catches up on.
+    seen_filter.add(url_digest(article.url))
+
+
+def defer_article(conn, seen_filter, article):
+    """
+    Schedule an article that failed to be checked to be tried again later.
+
+    Once it has used up its attempts, it is recorded as seen instead, and
+    True is returned. Articles skipped because their host's circuit was open
+    were never requested, so they're rescheduled without using up an attempt.
+    """
+    row = conn.execute("select attempts from retries where url = ?", (article.url,)).fetchone()
+    attempts = row[0] if row else 0
+
+    if not isinstance(article.error, HostUnavailable):
+        attempts += 1
+        if attempts >= config.get("retry_attempts", RETRY_ATTEMPTS):
+            print(f"Giving up on {article.url} after {attempts} attempts.")
+            record_article(conn, seen_filter, article)
+            return True
+
+    next_attempt = datetime.datetime.now(tz=datetime.UTC) + RETRY_BASE_DELAY * 2 ** max(
+        attempts - 1, 0
+    )
+    conn.execute(
+        """insert into retries(
+                 url, title, outlet, delicate, redirects, attempts, next_attempt, last_error)
+                 values (?, ?, ?, ?, ?, ?, ?, ?)
+                 on conflict(url) do update set
+                 attempts = excluded.attempts,
+                 next_attempt = excluded.next_attempt,
+                 last_error = excluded.last_error""",
+        (
+            article.url,
+            article.title,
+            article.outlet,
+            article.delicate,
+            article.redirects,
+            attempts,
+            next_attempt.isoformat(" "),
+            str(article.error),
+        ),
+    )
+    conn.commit()
+
+    # Pending URLs count as seen, so the feed they came from doesn't queue
+    # them up a second time.
+    seen_filter.add(url_digest(article.url))
+    return False
+
+
+def queue_post(conn, article):
+    """Queue a matching article to be posted with the next digest."""
+    conn.execute(
+        """insert or ignore into pending_posts(url, title, outlet, grafs, queued_at)
+                 values (?, ?, ?, ?, ?)""",
+        (
+            article.url,
+            article.title,
+            article.outlet,
+            json.dumps(article.matching_grafs[:4]),
+            datetime.datetime.now(tz=datetime.UTC).isoformat(" "),
+        ),
+    )
+    conn.commit()
+
+
+def digest_due(conn):
+    """Return when the queued matches are due to be posted, or None if there are none."""
+    (oldest,) = conn.execute("select min(queued_at) from pending_posts").fetchone()
+    if oldest is None:
+        return None
+    # digest may be set to true rather than to a mapping of settings.
+    digest_config = config["digest"] if isinstance(config.get("digest"), dict) else {}
+    window = digest_config.get("window_minutes", DIGEST_WINDOW_MINUTES)
+    return datetime.datetime.fromisoformat(oldest) + datetime.timedelta(minutes=window)
+
+
+def flush_digest(conn):
+    """
+    Post the queued matches as a digest, if the oldest has waited out the window.
+
+    Workers sharing the database each take the posts they manage to delete,
+    so no post goes out twice. Each platform is posted to separately, and
+    delivery is tracked per platform, so when posting fails a match is put
+    back in the queue for just the configured platforms it hasn't reached.
+    """
+    due = digest_due(conn)
+    if due is None or due > datetime.datetime.now(tz=datetime.UTC):
+        return
+
+    rows = conn.execute(
+        """select url, title, outlet, grafs, queued_at, tweeted, tooted from pending_posts
+                 order by queued_at"""
+    ).fetchall()
+    taken = []
+    for row in rows:
+        if conn.execute("delete from pending_posts where url = ?", (row[0],)).rowcount:
+            taken.append(row)
+    conn.commit()
+    if not taken:
+        return
+
+    articles = []
+    for url, title, outlet, grafs, _, tweeted, tooted in taken:
+        article = Article(outlet, title, url)
+        article.matching_grafs = json.loads(grafs)
+        article.tweeted = bool(tweeted)
+        article.tooted = bool(tooted)
         articles.append(article)
 
-    return articles
+    print(f"Posting a digest of {len(articles)} matches.")
+    errors = []
+    for flag, post_one, post_digest in (
+        ("tweeted", Article.tweet, tweet_digest),
+        ("tooted", Article.toot, toot_digest),
+    ):
+        unposted = [article for article in articles if not getattr(article, flag)]
+        try:
+            if len(unposted) == 1:
+                # No need for a digest's header and thread for a single article.
+                post_one(unposted[0])
+            elif unposted:
+                post_digest(unposted)
+        except Exception as e:  # noqa: BLE001 - re-raised below, once both platforms are tried
+            errors.append(e)
+
+    conn.executemany(
+        "update articles set tweeted = ?, tooted = ? where url = ?",
+        [(article.tweeted, article.tooted, article.url) for article in articles],
+    )
+    if errors:
+        conn.executemany(
+            """insert or ignore into pending_posts(
+                     url, title, outlet, grafs, queued_at, tweeted, tooted)
+                     values (?, ?, ?, ?, ?, ?, ?)""",
+            [
+                (*row[:5], article.tweeted, article.tooted)
+                for row, article in zip(taken, articles, strict=True)
+                if ("twitter" in config and not article.tweeted)
+                or ("mastodon" in config and not article.tooted)
+            ],
+        )
+    conn.commit()
+
+    if errors:
+        raise errors[0]
+
+
+def due_retries(conn):
+    """Return the deferred articles that are due to be tried again."""
+    now = datetime.datetime.now(tz=datetime.UTC)
+    rows = conn.execute(
+        """select outlet, title, url, delicate, redirects from retries
+                 where next_attempt <= ? order by next_attempt""",
+        (now.isoformat(" "),),
+    ).fetchall()
+    return [
+        Article(outlet, title, url, bool(delicate), bool(redirects))
+        for outlet, title, url, delicate, redirects in rows
+    ]
+
+
+def claimed_articles(articles, coordinator, feed_url=None):
+    """
+    Yield only the articles this worker has claimed from the coordinator.
+
+    If the articles come from a feed this worker has leased, the lease is
+    renewed as they go, and they stop if it has been lost to another worker.
+    """
+    for article in articles:
+        if feed_url and not coordinator.acquire_feed(feed_url):
+            print(f"Lost the lease on {feed_url} to another worker. Leaving the rest to it.")
+            return
+        if coordinator.claim_article(article.url):
+            yield article
+
+
+def process_articles(
+    articles,
+    conn,
+    seen_filter,
+    http_session,
+    blocklist=None,
+    breaker=None,
+    coordinator=None,
+    extractions=None,
+    pause=True,
+):
+    """
+    Check articles for matches, post the ones that match, and record or defer each one.
+
+    Unless pause is False, it waits a second after each article it downloads,
+    to go easy on the sites being checked.
+    """
+    articles = checked_articles(
+        articles, http_session, blocklist=blocklist, breaker=breaker, extractions=extractions
+    )
+    for article in articles:
+        if article.error:
+            recorded = defer_article(conn, seen_filter, article)
+        else:
+            if article.matching_grafs:
+                print("Got one!")
+                if config.get("digest"):
+                    queue_post(conn, article)
+                else:
+                    article.tweet()
+                    article.toot()
+
+            record_article(conn, seen_filter, article)
+            recorded = True
+
+        if coordinator:
+            coordinator.release_article(article.url, recorded)
+
+        if pause and not isinstance(article.error, HostUnavailable):
+            time.sleep(1)
+
+
+def poll_feed(
+    feed,
+    conn,
+    seen_filter,
+    http_session,
+    blocklist=None,
+    breaker=None,
+    coordinator=None,
+    body=None,
+):
+    """
+    Fetch a feed, or parse a pushed copy of it, and process its new articles.
+
+    Polling a feed needs a lease on it from the coordinator, so that two
+    workers don't poll it at once. Pushes skip the lease: they arrive at one
+    worker only, and claiming each article still keeps them from being posted
+    twice.
+    """
+    url = feed["url"]
+    leased = coordinator is not None and body is None
+    if leased and not coordinator.acquire_feed(url):
+        print(f"Another worker is polling {url}. Skipping.")
+        return
+
+    try:
+        try:
+            if breaker and body is None:
+                breaker.check(url)
+            articles = parse_feed(
+                feed["outlet"], url, feed["delicate"], feed["redirects"], http_session, body=body
+            )
+        except (requests.RequestException, HostUnavailable) as e:
+            if breaker and is_transient(e) and not isinstance(e, HostUnavailable):
+                breaker.record_failure(url)
+            print(f"Unable to fetch feed: {e}. Skipping for now.")
+            return
+
+        # Each stage pulls one article at a time from the one before it, so
+        # only the article currently being handled is held in memory, and an
+        # article is recorded before the next one is even created.
+        articles = unseen_articles(articles, conn, seen_filter)
+        if coordinator:
+            articles = claimed_articles(articles, coordinator, feed_url=url if leased else None)
+        process_articles(
+            articles,
+            conn,
+            seen_filter,
+            http_session,
+            blocklist=blocklist,
+            breaker=breaker,
+            coordinator=coordinator,
+        )
+    finally:
+        if leased:
+            coordinator.release_feed(url)
+
+
+def retry_articles(conn, seen_filter, http_session, blocklist=None, breaker=None, coordinator=None):
+    """Try the deferred articles that are due again."""
+    retries = due_retries(conn)
+    if retries:
+        print(f"Retrying {len(retries)} articles that failed before.")
+        if coordinator:
+            retries = claimed_articles(retries, coordinator)
+        process_articles(
+            retries,
+            conn,
+            seen_filter,
+            http_session,
+            blocklist=blocklist,
+            breaker=breaker,
+            coordinator=coordinator,
+        )
+
+
+def next_poll_delay(listener, feed_url, poll_interval, push_poll_interval):
+    """
+    Return how many seconds to wait before polling a feed again.
+
+    Feeds that push their updates are polled less often, but still in time to
+    renew their subscription, since that only happens when a feed is polled.
+    """
+    if not listener.is_subscribed(feed_url):
+        return poll_interval
+    renew_in = listener.renew_at(feed_url) - time.time()
+    return min(push_poll_interval, max(renew_in, poll_interval))
+
+
+def listen(bot, http_session):
+    """
+    Keep running, polling feeds on a schedule and processing WebSub pushes.
+
+    Feeds are polled every poll_interval_minutes. Each feed's hub, if it has
+    one, is subscribed to along the way, and once the hub is pushing to us
+    the feed is only polled as a fallback. Between polls, pushed feed bodies
+    go through the same pipeline as polled ones.
+
+    An error while handling one feed, push or digest, such as a rate limit
+    hit while posting, is logged and doesn't stop the listener. The bot's
+    database and seen filter are maintained once a day, as they would be by
+    a fresh run.
+    """
+    artifact, conn = bot.artifact, bot.conn
+    blocklist, coordinator = bot.blocklist, bot.coordinator
+
+    websub_config = config.get("websub") or {}
+    if "callback_url" not in websub_config:
+        sys.exit(
+            "To listen for WebSub pushes, set websub.callback_url in config.yaml"
+            " to the public URL that reaches the listener."
+        )
+
+    listener = WebSubListener(
+        websub_config["callback_url"],
+        host=websub_config.get("host", "127.0.0.1"),
+        port=websub_config.get("port", 8080),
+        lease_seconds=websub_config.get("lease_seconds"),
+    )
+    listener.start()
+    print(f"Listening for WebSub pushes on port {listener.port}.")
+
+    next_poll = {}
+    next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL_HOURS * 60 * 60
+    try:
+        while True:
+            reload_sources(artifact)
+            if next_maintenance <= time.monotonic():
+                bot.maintain()
+                next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL_HOURS * 60 * 60
+            seen_filter = bot.seen_filter
+
+            http_session.headers.update({"User-Agent": ua})
+            websub_config = config.get("websub") or {}
+            poll_interval = 60 * config.get("poll_interval_minutes", POLL_INTERVAL_MINUTES)
+            push_poll_interval = 60 * websub_config.get(
+                "poll_interval_minutes", WEBSUB_POLL_INTERVAL_MINUTES
+            )
+            breaker = CircuitBreaker(
+                config.get("circuit_breaker_threshold", CIRCUIT_BREAKER_THRESHOLD)
+            )
+
+            try:
+                retry_articles(
+                    conn,
+                    seen_filter,
+                    http_session,
+                    blocklist=blocklist,
+                    breaker=breaker,
+                    coordinator=coordinator,
+                )
+            except Exception as e:  # noqa: BLE001 - keep listening
+                print(f"Unable to retry deferred articles: {e}")
+
+            # Forget feeds that have been removed or changed since the last pass,
+            # so they don't hold the next deadline in the past.
+            feeds = sharded_feeds(artifact.value["rss_feeds"])
+            urls = {feed["url"] for feed in feeds}
+            next_poll = {url: due for url, due in next_poll.items() if url in urls}
+
+            for feed in feeds:
+                if next_poll.get(feed["url"], 0) > time.monotonic():
+                    continue
+
+                if listener.needs_subscription(feed["url"]):
+                    try:
+                        listener.subscribe(feed, http_session, timeout=HTTP_TIMEOUT_SECONDS)
+                    except requests.RequestException as e:
+                        print(f"Unable to subscribe to {feed['url']}: {e}")
+
+                try:
+                    poll_feed(
+                        feed,
+                        conn,
+                        seen_filter,
+                        http_session,
+                        blocklist=blocklist,
+                        breaker=breaker,
+                        coordinator=coordinator,
+                    )
+                except Exception as e:  # noqa: BLE001 - keep listening
+                    print(f"Unable to poll {feed['url']}: {e}")
+
+                next_poll[feed["url"]] = time.monotonic() + next_poll_delay(
+                    listener, feed["url"], poll_interval, push_poll_interval
+                )
+
+            try:
+                flush_digest(conn)
+            except Exception as e:  # noqa: BLE001 - keep listening
+                print(f"Unable to post the digest: {e}")
+            save_seen_filter(conn, seen_filter, bot.seen_filter_path)
+
+            # Handle pushes as they come in, until the next feed or digest is due.
+            # A digest that's overdue because posting it failed is tried again
+            # after a minute, rather than straight away.
+            deadline = min(next_poll.values(), default=time.monotonic() + poll_interval)
+            if (due := digest_due(conn)) is not None:
+                until_due = due - datetime.datetime.now(tz=datetime.UTC)
+                deadline = min(deadline, time.monotonic() + max(until_due.total_seconds(), 60))
+            while (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    feed, body = listener.pushed.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                print(f"Received a push for {feed['url']}.")
+                try:
+                    poll_feed(
+                        feed,
+                        conn,
+                        seen_filter,
+                        http_session,
+                        blocklist=blocklist,
+                        breaker=breaker,
+                        coordinator=coordinator,
+                        body=body,
+                    )
+                except Exception as e:  # noqa: BLE001 - keep listening
+                    print(f"Unable to process the push for {feed['url']}: {e}")
+    except KeyboardInterrupt:
+        print("Stopping.")
+    finally:
+        listener.stop()
 
 
 def config_twitter(config):
@@ -421,6 +1175,39 @@ def setup_db(config):
             tweeted     boolean,
             tooted      boolean,
             recorded_at datetime
+        );
+        create index articles_url on articles(url);
+        create table seen_urls (
+            url_hash    blob primary key not null
+        ) without rowid;
+        create table retries (
+            url          text primary key not null,
+            title        text,
+            outlet       text,
+            delicate     boolean,
+            redirects    boolean,
+            attempts     integer not null,
+            next_attempt datetime not null,
+            last_error   text
+        );
+        create table feed_leases (
+            feed_url    text primary key not null,
+            owner       text not null,
+            expires_at  real not null
+        );
+        create table article_claims (
+            url         text primary key not null,
+            owner       text not null,
+            expires_at  real not null
+        );
+        create table pending_posts (
+            url         text primary key not null,
+            title       text,
+            outlet      text,
+            grafs       text not null,
+            queued_at   datetime not null,
+            tweeted     boolean not null default 0,
+            tooted      boolean not null default 0
         );"""
         conn.executescript(schema_script)
         conn.commit()
@@ -535,164 +1322,700 @@ def apply_migrations(conn):
         conn.execute("ALTER TABLE articles ADD COLUMN tooted boolean")
         conn.commit()
 
+    indexes = [row[1] for row in conn.execute("PRAGMA index_list(articles)")]
+    if "articles_url" not in indexes:
+        print("Adding missing index on articles.url")
+        conn.execute("CREATE INDEX articles_url ON articles(url)")
+        conn.commit()
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Track articles from RSS feeds for a custom list of keywords"
-        " and act on the matches."
-    )
-
-    parser.add_argument("-c", "--config", help="Run configuration process", action="store_true")
-    parser.add_argument(
-        "dir",
-        nargs="?",
-        help="The directory to store or find the configuration files.",
-        default=os.path.join(os.getcwd(), "ttnconfig"),
-    )
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    if "seen_urls" not in tables:
+        print("Adding missing 'seen_urls' table")
+        conn.execute("CREATE TABLE seen_urls (url_hash blob PRIMARY KEY NOT NULL) WITHOUT ROWID")
+        conn.commit()
 
-    args = parser.parse_args()
+    if "retries" not in tables:
+        print("Adding missing 'retries' table")
+        conn.execute(
+            """CREATE TABLE retries (
+                url          text PRIMARY KEY NOT NULL,
+                title        text,
+                outlet       text,
+                delicate     boolean,
+                redirects    boolean,
+                attempts     integer NOT NULL,
+                next_attempt datetime NOT NULL,
+                last_error   text
+            )"""
+        )
+        conn.commit()
 
-    global home
-    home = os.path.abspath(args.dir)
+    if "feed_leases" not in tables:
+        print("Adding missing 'feed_leases' table")
+        conn.execute(
+            """CREATE TABLE feed_leases (
+                feed_url    text PRIMARY KEY NOT NULL,
+                owner       text NOT NULL,
+                expires_at  real NOT NULL
+            )"""
+        )
+        conn.commit()
 
-    print(f"Running with configuration files in {home}")
+    if "article_claims" not in tables:
+        print("Adding missing 'article_claims' table")
+        conn.execute(
+            """CREATE TABLE article_claims (
+                url         text PRIMARY KEY NOT NULL,
+                owner       text NOT NULL,
+                expires_at  real NOT NULL
+            )"""
+        )
+        conn.commit()
 
-    if args.config:
-        initial_setup()
-        sys.exit(
-            "Created new configuration files."
-            " Now go populate the RSS Feed file and the list of matchwords!"
+    if "pending_posts" not in tables:
+        print("Adding missing 'pending_posts' table")
+        conn.execute(
+            """CREATE TABLE pending_posts (
+                url         text PRIMARY KEY NOT NULL,
+                title       text,
+                outlet      text,
+                grafs       text NOT NULL,
+                queued_at   datetime NOT NULL,
+                tweeted     boolean NOT NULL DEFAULT 0,
+                tooted      boolean NOT NULL DEFAULT 0
+            )"""
         )
+        conn.commit()
 
-    configfile = os.path.join(home, "config.yaml")
-    if not os.path.isfile(configfile):
-        initial_setup()
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(pending_posts)")]
+    for column in ("tweeted", "tooted"):
+        if column not in columns:
+            print(f"Adding missing '{column}' column to pending_posts")
+            conn.execute(
+                f"ALTER TABLE pending_posts ADD COLUMN {column} boolean NOT NULL DEFAULT 0"
+            )
+            conn.commit()
+
+
+def load_seen_filter(conn, path):
+    """Load the seen-URL filter from path, rebuilding it from the database if needed."""
+    seen_filter = BloomFilter.load(path)
+    (max_id,) = conn.execute("select coalesce(max(id), 0) from articles").fetchone()
+
+    # A filter that is over capacity has a climbing false positive rate, and one
+    # that is ahead of the database belongs to some other database.
+    if seen_filter is None or seen_filter.saturated or seen_filter.last_article_id > max_id:
+        (total,) = conn.execute(
+            "select (select count(*) from articles) + (select count(*) from seen_urls)"
+        ).fetchone()
+        seen_filter = BloomFilter(max(total * 2, SEEN_FILTER_MIN_CAPACITY))
+        for (digest,) in conn.execute("select url_hash from seen_urls"):
+            seen_filter.add(digest)
+
+    catch_up_seen_filter(conn, seen_filter)
+
+    # Articles waiting to be retried aren't tracked by id, but there are few
+    # enough of them to add every time.
+    for (url,) in conn.execute("select url from retries"):
+        seen_filter.add(url_digest(url))
+
+    return seen_filter
+
+
+def catch_up_seen_filter(conn, seen_filter):
+    """Add the articles recorded since the filter last caught up."""
+    for article_id, url in conn.execute(
+        "select id, url from articles where id > ? order by id", (seen_filter.last_article_id,)
+    ):
+        seen_filter.add(url_digest(url))
+        seen_filter.last_article_id = article_id
+
+
+def save_seen_filter(conn, seen_filter, path):
+    """Save the filter, including anything other workers recorded in the meantime."""
+    catch_up_seen_filter(conn, seen_filter)
+    seen_filter.save(path)
+
+
+def url_seen(conn, seen_filter, url):
+    """Return whether url has already been recorded, live or archived, or is waiting for a retry."""
+    digest = url_digest(url)
+    if digest not in seen_filter:
+        return False
+
+    if conn.execute("select 1 from articles where url = ? limit 1", (url,)).fetchone():
+        return True
+    if conn.execute("select 1 from retries where url = ?", (url,)).fetchone():
+        return True
+    return (
+        conn.execute("select 1 from seen_urls where url_hash = ?", (digest,)).fetchone() is not None
+    )
 
-    global config
-    with open(configfile, encoding="utf-8") as f:
-        config = yaml.full_load(f)
 
-    global ua
-    ua = config["user-agent"]
+def prune_articles(conn, retention_days):
+    """
+    Archive articles recorded more than retention_days ago.
 
-    database = os.path.join(home, config["db"])
-    if not os.path.isfile(database):
-        setup_db(config)
+    Archived articles keep only a digest of their URL in seen_urls, which is
+    enough to stop them from being posted again. The newest row is always
+    kept so that article ids never restart and the seen filter can keep
+    catching up by id.
+    """
+    cutoff = datetime.datetime.now(tz=datetime.UTC) - datetime.timedelta(days=retention_days)
+    where = "recorded_at < ? and id < (select max(id) from articles)"
+    params = (cutoff.isoformat(" "),)
+
+    urls = conn.execute(f"select url from articles where {where}", params).fetchall()
+    conn.executemany(
+        "insert or ignore into seen_urls(url_hash) values (?)",
+        ((url_digest(url),) for (url,) in urls),
+    )
+    conn.execute(f"delete from articles where {where}", params)
+    conn.commit()
 
-    conn = sqlite3.connect(database)
+    return len(urls)
 
-    apply_migrations(conn)
 
-    matchlist = os.path.join(home, "matchlist.txt")
-    matchlist_case_sensitive = os.path.join(home, "matchlist_case_sensitive.txt")
-    if not (os.path.isfile(matchlist) and os.path.isfile(matchlist_case_sensitive)):
-        setup_matchlist()
+class SQLiteCoordinator(BaseCoordinator):
+    """
+    Coordinates workers sharing a database with lease and claim rows in it.
+
+    Feed leases keep two workers from polling the same feed at once. Article
+    claims make checking and posting atomic across workers: an article can
+    only be claimed if it hasn't been recorded, and only by one worker at a
+    time. Both expire, so a worker that dies doesn't hold on to anything.
+    """
 
-    global matchwords
-    global matchwords_case_sensitive
-    with open(matchlist, "r", encoding="utf-8") as f:
-        matchwords = [w for w in f.read().split("\n") if w]
-    with open(matchlist_case_sensitive, "r", encoding="utf-8") as f:
-        matchwords_case_sensitive = [w for w in f.read().split("\n") if w]
+    def __init__(self, conn, worker_id, lease_seconds=LEASE_MINUTES * 60, hold_seconds=0):
+        self.conn = conn
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        # A polled feed stays with its worker for this long after it's
+        # released, so other workers don't poll it again straight away.
+        self.hold_seconds = hold_seconds
+
+    def acquire_feed(self, feed_url):
+        now = time.time()
+        cursor = self.conn.execute(
+            """insert into feed_leases(feed_url, owner, expires_at) values (?, ?, ?)
+                     on conflict(feed_url) do update set
+                     owner = excluded.owner,
+                     expires_at = excluded.expires_at
+                     where feed_leases.owner = excluded.owner or feed_leases.expires_at < ?""",
+            (feed_url, self.worker_id, now + self.lease_seconds, now),
+        )
+        self.conn.commit()
+        return cursor.rowcount == 1
 
-    if not (matchwords or matchwords_case_sensitive):
-        sys.exit(
-            "You must add words to at least one of the matchwords lists,"
-            f" located at {matchlist} and {matchlist_case_sensitive}."
+    def release_feed(self, feed_url):
+        self.conn.execute(
+            "update feed_leases set expires_at = ? where feed_url = ? and owner = ?",
+            (time.time() + self.hold_seconds, feed_url, self.worker_id),
+        )
+        self.conn.commit()
+
+    def claim_article(self, url):
+        now = time.time()
+        # A single statement, so the check against recorded articles and the
+        # claim itself can't be interleaved with another worker's. Articles
+        # deferred by any worker can't be claimed until their retry is due.
+        cursor = self.conn.execute(
+            """insert into article_claims(url, owner, expires_at)
+                     select ?, ?, ?
+                     where not exists (select 1 from articles where url = ?)
+                     and not exists (select 1 from seen_urls where url_hash = ?)
+                     and not exists (select 1 from retries where url = ? and next_attempt > ?)
+                     on conflict(url) do update set
+                     owner = excluded.owner,
+                     expires_at = excluded.expires_at
+                     where article_claims.expires_at < ?""",
+            (
+                url,
+                self.worker_id,
+                now + self.lease_seconds,
+                url,
+                url_digest(url),
+                url,
+                datetime.datetime.now(tz=datetime.UTC).isoformat(" "),
+                now,
+            ),
+        )
+        self.conn.commit()
+        return cursor.rowcount == 1
+
+    def release_article(self, url, recorded):
+        # Once recorded, the articles table keeps the article from being
+        # claimed again, so the claim row can go either way.
+        self.conn.execute(
+            "delete from article_claims where url = ? and owner = ?", (url, self.worker_id)
         )
+        self.conn.commit()
 
-    sys.path.append(home)
+
+def load_module(name, path):
+    """
+    Import a Python file from a configuration directory.
+
+    Loading by path rather than by name keeps, say, two bots' blocklist.py
+    files from resolving to whichever of them was imported first.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_blocklist():
+    """Return an instance of the CustomBlocklist in home, or None if there isn't one."""
     global blocklist_loaded
+    blocklist_loaded = False
 
     blocklist_path = os.path.join(home, "blocklist.py")
 
-    if os.path.exists(blocklist_path):
-        try:
-            from blocklist import CustomBlocklist
-
-            blocklist_instance = CustomBlocklist()
-            blocklist_loaded = True
-            print("Loaded blocklist.")
-        except ImportError as e:
-            blocklist_loaded = False
-            print(f"Error loading blocklist: {e}")
-        except Exception as e:  # noqa: BLE001 - blocklist.py is arbitrary user code; any error can be raised
-            blocklist_loaded = False
-            print(f"Unexpected error loading blocklist: {e}")
-    else:
-        blocklist_loaded = False
+    if not os.path.exists(blocklist_path):
         print("No blocklist file found to load.")
+        return None
+
+    try:
+        blocklist_instance = load_module("blocklist", blocklist_path).CustomBlocklist()
+    except ImportError as e:
+        print(f"Error loading blocklist: {e}")
+        return None
+    except Exception as e:  # noqa: BLE001 - blocklist.py is arbitrary user code; any error can be raised
+        print(f"Unexpected error loading blocklist: {e}")
+        return None
 
-    if matchwords:
-        print(f"Matching against the following words: {matchwords}")
-    if matchwords_case_sensitive:
-        print(f"Matching against the following case-sensitive words: {matchwords_case_sensitive}")
+    blocklist_loaded = True
+    print("Loaded blocklist.")
+    return blocklist_instance
 
+
+def get_worker_id():
+    """Return the name this worker goes by in leases and claims."""
+    shard_config = config.get("shard") or {}
+    return shard_config.get("worker_id") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def sharded_feeds(feeds):
+    """
+    Return the feeds in the order this worker should poll them.
+
+    When several workers share the feed list, each one starts at a different
+    point in it, so they spread out instead of contending for the same feeds.
+    """
+    if not config.get("shard") or not feeds:
+        return feeds
+    offset = zlib.crc32(get_worker_id().encode("utf-8")) % len(feeds)
+    return feeds[offset:] + feeds[:offset]
+
+
+def load_coordinator(conn):
+    """
+    Return the coordinator for this run, or None if it runs alone.
+
+    A CustomCoordinator in coordinator.py in the config directory takes
+    precedence, for workers that can't share a database file. Otherwise
+    workers only coordinate through the database when shard is set, so a
+    single process doesn't pay for leases and claims it doesn't need.
+    """
+    coordinator_path = os.path.join(home, "coordinator.py")
+    if os.path.exists(coordinator_path):
+        coordinator = load_module("coordinator", coordinator_path).CustomCoordinator()
+        print("Loaded custom coordinator.")
+        return coordinator
+
+    if not config.get("shard"):
+        return None
+
+    shard_config = config["shard"] if isinstance(config["shard"], dict) else {}
+    return SQLiteCoordinator(
+        conn,
+        get_worker_id(),
+        lease_seconds=60 * shard_config.get("lease_minutes", LEASE_MINUTES),
+        hold_seconds=60 * shard_config.get("hold_minutes", 0),
+    )
+
+
+class SourcesError(Exception):
+    """Raised when the configuration files can't be read or don't make sense."""
+
+
+def compile_sources():
+    """
+    Read the configuration files in home and return what a run needs from them.
+
+    Raises SourcesError if any of them is missing, malformed or incomplete,
+    which they often briefly are while being edited.
+    """
+    configfile = os.path.join(home, "config.yaml")
     rssfeedsfile = os.path.join(home, "rssfeeds.json")
-    if not os.path.isfile(rssfeedsfile):
-        setup_rssfeedsfile()
+    try:
+        with open(configfile, encoding="utf-8") as f:
+            config = yaml.full_load(f)
 
-    with open(rssfeedsfile, "r", encoding="utf-8") as f:
-        try:
-            rss_feeds = json.load(f)
-        except json.JSONDecodeError:
-            sys.exit(f"You must add RSS feeds to the RSS feeds list, located at {rssfeedsfile}.")
-
-    with requests.Session() as http_session:
-        http_session.headers.update({"User-Agent": ua})
-        for feed in rss_feeds:
-            outlet = feed.get("outlet", "")
-            url = feed["url"]
-            delicate = bool(feed.get("delicateURLs"))
-            redirects = bool(feed.get("redirectLinks"))
+        with open(os.path.join(home, "matchlist.txt"), "r", encoding="utf-8") as f:
+            matchwords = [w for w in f.read().split("\n") if w]
+        with open(os.path.join(home, "matchlist_case_sensitive.txt"), "r", encoding="utf-8") as f:
+            matchwords_case_sensitive = [w for w in f.read().split("\n") if w]
+
+        with open(rssfeedsfile, "r", encoding="utf-8") as f:
+            feeds = json.load(f)
+    except (OSError, yaml.YAMLError) as e:
+        raise SourcesError(e) from e
+    except json.JSONDecodeError as e:
+        raise SourcesError(
+            f"You must add RSS feeds to the RSS feeds list, located at {rssfeedsfile}. ({e})"
+        ) from e
+
+    if not isinstance(config, dict) or "user-agent" not in config:
+        raise SourcesError(f"{configfile} must set a user-agent.")
+    if not isinstance(feeds, list) or not all(
+        isinstance(feed, dict) and "url" in feed for feed in feeds
+    ):
+        raise SourcesError(f"{rssfeedsfile} must be a list of feeds, each with a url.")
+
+    rss_feeds = [
+        {
+            "outlet": feed.get("outlet", ""),
+            "url": feed["url"],
+            "delicate": bool(feed.get("delicateURLs")),
+            "redirects": bool(feed.get("redirectLinks")),
+        }
+        for feed in feeds
+    ]
 
-            try:
-                articles = parse_feed(outlet, url, delicate, redirects, http_session)
-            except requests.HTTPError as e:
-                print(f"Unable to fetch feed: {e}. Skipping for now.")
-                continue
-            deduped = []
-
-            for article in articles:
-                article_exists = conn.execute(
-                    "select * from articles where url = ?", (article.url,)
-                ).fetchall()
-                if not article_exists:
-                    deduped.append(article)
-
-            for counter, article in enumerate(deduped, 1):
-                print(f"Checking {article.outlet} article {counter}/{len(deduped)}")
+    return {
+        "config": config,
+        "rss_feeds": rss_feeds,
+        "matcher": Matcher(matchwords, matchwords_case_sensitive),
+    }
 
-                try:
-                    article.check_for_matches(http_session, blocklist=blocklist_instance)
-                except Exception as e:  # noqa: BLE001 - can raise from requests, parsing, or user blocklist code
-                    print(e)
-                    print("Having trouble with that article. Skipping for now.")
 
-                if article.matching_grafs:
-                    print("Got one!")
-                    article.tweet()
-                    article.toot()
+def get_sources_artifact():
+    """Return the on-disk cache of compile_sources() for the files in home."""
+    sources = [
+        os.path.join(home, filename)
+        for filename in (
+            "config.yaml",
+            "matchlist.txt",
+            "matchlist_case_sensitive.txt",
+            "rssfeeds.json",
+        )
+    ]
+    return CachedArtifact(os.path.join(home, COMPILED_FILENAME), sources, compile_sources)
+
+
+def apply_sources(sources):
+    """Install compiled sources as the module-level state the rest of the run reads."""
+    global config, ua, matcher
+    config = sources["config"]
+    ua = config["user-agent"]
+    matcher = sources["matcher"]
 
-                conn.execute(
-                    """insert into articles(
-                             title, outlet, url, tweeted, tooted, recorded_at)
-                             values (?, ?, ?, ?, ?, ?)""",
-                    (
-                        article.title,
-                        article.outlet,
-                        article.url,
-                        article.tweeted,
-                        article.tooted,
-                        datetime.datetime.now(tz=datetime.UTC),
-                    ),
-                )
 
-                conn.commit()
+def reload_sources(artifact):
+    """Pick up changes to the configuration files, keeping the old state if they're broken."""
+    try:
+        if artifact.refresh():
+            print("Configuration files changed. Reloading.")
+            apply_sources(artifact.value)
+    except SourcesError as e:
+        print(f"Unable to reload configuration files ({e}). Keeping the previous ones.")
+
 
+class Bot:
+    """
+    Everything that belongs to one configuration directory.
+
+    The rest of this module reads its configuration from module-level
+    globals, which activate() points at this bot. A process serving several
+    configuration directories switches between them that way.
+    """
+
+    def __init__(self, directory):
+        self.home = os.path.abspath(directory)
+        self.artifact = None
+        self.conn = None
+        self.seen_filter = None
+        self.seen_filter_path = None
+        self.blocklist = None
+        self.coordinator = None
+        self.image_cache = None
+
+    def activate(self):
+        global home, image_cache
+        home = self.home
+        image_cache = self.image_cache
+        if self.artifact and self.artifact.value:
+            apply_sources(self.artifact.value)
+
+    def reload(self):
+        """Activate the bot, picking up any changes to its configuration files."""
+        self.activate()
+        reload_sources(self.artifact)
+
+    @property
+    def feeds(self):
+        return self.artifact.value["rss_feeds"]
+
+    def setup(self):
+        """Load the bot's configuration, database and extensions, creating what's missing."""
+        self.activate()
+        print(f"Running with configuration files in {home}")
+
+        configfile = os.path.join(home, "config.yaml")
+        if not os.path.isfile(configfile):
+            initial_setup()
+
+        matchlist = os.path.join(home, "matchlist.txt")
+        matchlist_case_sensitive = os.path.join(home, "matchlist_case_sensitive.txt")
+        if not (os.path.isfile(matchlist) and os.path.isfile(matchlist_case_sensitive)):
+            setup_matchlist()
+
+        rssfeedsfile = os.path.join(home, "rssfeeds.json")
+        if not os.path.isfile(rssfeedsfile):
+            setup_rssfeedsfile()
+
+        self.artifact = get_sources_artifact()
+        try:
+            self.artifact.refresh()
+        except SourcesError as e:
+            sys.exit(str(e))
+        apply_sources(self.artifact.value)
+
+        if not matcher:
+            sys.exit(
+                "You must add words to at least one of the matchwords lists,"
+                f" located at {matchlist} and {matchlist_case_sensitive}."
+            )
+
+        database = os.path.join(home, config["db"])
+        if not os.path.isfile(database):
+            setup_db(config)
+
+        # Several workers may share the database, so wait on each other's
+        # writes rather than failing, and let readers carry on during a write.
+        self.conn = sqlite3.connect(database, timeout=HTTP_TIMEOUT_SECONDS)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+
+        apply_migrations(self.conn)
+
+        self.seen_filter_path = os.path.join(home, SEEN_FILTER_FILENAME)
+        self.maintain()
+
+        image_cache_mb = config.get("image_cache_mb", IMAGE_CACHE_MB)
+        if image_cache_mb:
+            self.image_cache = ImageCache(
+                os.path.join(home, IMAGE_CACHE_DIRNAME), image_cache_mb * 1024 * 1024, IMAGE_FORMAT
+            )
+            self.activate()
+
+        sys.path.append(home)
+        self.blocklist = load_blocklist()
+        self.coordinator = load_coordinator(self.conn)
+
+        if matcher.words:
+            print(f"Matching against the following words: {matcher.words}")
+        if matcher.words_case_sensitive:
+            print(
+                "Matching against the following case-sensitive words:"
+                f" {matcher.words_case_sensitive}"
+            )
+
+    def maintain(self):
+        """Archive articles past retention_days, and (re)build the seen filter if it's full."""
+        if config.get("retention_days"):
+            pruned = prune_articles(self.conn, config["retention_days"])
+            if pruned:
+                print(f"Archived {pruned} articles older than {config['retention_days']} days.")
+
+        if self.seen_filter is None or self.seen_filter.saturated:
+            if self.seen_filter is not None:
+                # Saved first, so that loading it finds it saturated and rebuilds it.
+                save_seen_filter(self.conn, self.seen_filter, self.seen_filter_path)
+            self.seen_filter = load_seen_filter(self.conn, self.seen_filter_path)
+
+    def close(self):
+        save_seen_filter(self.conn, self.seen_filter, self.seen_filter_path)
+        self.conn.close()
+
+
+def poll_shared_feed(url, delicate, redirects, followers, http_session, breaker):
+    """
+    Poll a feed once on behalf of every bot that follows it.
+
+    followers is a list of (bot, feed) pairs, where feed is the bot's own
+    entry for the feed, with its own outlet name. Each article is downloaded
+    and extracted once, then handed to each bot in turn to be deduplicated
+    against its database, matched, and posted from its accounts.
+    """
+    leased = [
+        (bot, feed)
+        for bot, feed in followers
+        if bot.coordinator is None or bot.coordinator.acquire_feed(url)
+    ]
+    if not leased:
+        print(f"Another worker is polling {url}. Skipping.")
+        return
+
+    try:
+        try:
+            breaker.check(url)
+            articles = parse_feed("", url, delicate, redirects, http_session)
+        except (requests.RequestException, HostUnavailable) as e:
+            if is_transient(e) and not isinstance(e, HostUnavailable):
+                breaker.record_failure(url)
+            print(f"Unable to fetch feed: {e}. Skipping for now.")
+            return
+
+        extractions = ExtractionCache()
+        for article in articles:
+            for bot, feed in leased:
+                bot.activate()
+                copy = Article(feed["outlet"], article.title, article.url, delicate, redirects)
+                copies = unseen_articles([copy], bot.conn, bot.seen_filter)
+                if bot.coordinator:
+                    copies = claimed_articles(copies, bot.coordinator, feed_url=url)
+                process_articles(
+                    copies,
+                    bot.conn,
+                    bot.seen_filter,
+                    http_session,
+                    blocklist=bot.blocklist,
+                    breaker=breaker,
+                    coordinator=bot.coordinator,
+                    extractions=extractions,
+                    pause=False,
+                )
+
+            if extractions.fetched:
                 time.sleep(1)
+            extractions.clear()
+    finally:
+        for bot, _ in leased:
+            if bot.coordinator:
+                bot.coordinator.release_feed(url)
+
+
+def poll_shared_feeds(bots, http_session):
+    """Poll the feeds of several bots, fetching each feed only once."""
+    breaker = CircuitBreaker(config.get("circuit_breaker_threshold", CIRCUIT_BREAKER_THRESHOLD))
+
+    for bot in bots:
+        bot.activate()
+        retry_articles(
+            bot.conn,
+            bot.seen_filter,
+            http_session,
+            blocklist=bot.blocklist,
+            breaker=breaker,
+            coordinator=bot.coordinator,
+        )
+
+    followers = {}
+    for bot in bots:
+        bot.activate()
+        for feed in sharded_feeds(bot.feeds):
+            key = (feed["url"], feed["delicate"], feed["redirects"])
+            followers.setdefault(key, []).append((bot, feed))
+
+    for (url, delicate, redirects), feed_followers in followers.items():
+        for bot, _ in feed_followers:
+            bot.reload()
+        poll_shared_feed(url, delicate, redirects, feed_followers, http_session, breaker)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Track articles from RSS feeds for a custom list of keywords"
+        " and act on the matches."
+    )
+
+    parser.add_argument("-c", "--config", help="Run configuration process", action="store_true")
+    parser.add_argument(
+        "-l",
+        "--listen",
+        help="Keep running, polling feeds on a schedule and accepting WebSub pushes",
+        action="store_true",
+    )
+    parser.add_argument(
+        "dir",
+        nargs="*",
+        help="The directory to store or find the configuration files. Given several,"
+        " one process serves all of them, fetching the feeds and articles they share once.",
+        default=[os.path.join(os.getcwd(), "ttnconfig")],
+    )
+
+    args = parser.parse_args()
+
+    bots = [Bot(directory) for directory in args.dir]
 
-    conn.close()
+    if args.config:
+        for bot in bots:
+            bot.activate()
+            print(f"Running with configuration files in {home}")
+            initial_setup()
+        sys.exit(
+            "Created new configuration files."
+            " Now go populate the RSS Feed file and the list of matchwords!"
+        )
+
+    if args.listen and len(bots) > 1:
+        sys.exit("--listen only supports a single configuration directory.")
+
+    for bot in bots:
+        bot.setup()
+
+    try:
+        with requests.Session() as http_session:
+            # Shared fetches go out under the first bot's user-agent.
+            bot = bots[0]
+            bot.activate()
+            http_session.headers.update({"User-Agent": ua})
+
+            if len(bots) > 1:
+                poll_shared_feeds(bots, http_session)
+            elif args.listen:
+                listen(bot, http_session)
+            else:
+                breaker = CircuitBreaker(
+                    config.get("circuit_breaker_threshold", CIRCUIT_BREAKER_THRESHOLD)
+                )
+
+                retry_articles(
+                    bot.conn,
+                    bot.seen_filter,
+                    http_session,
+                    blocklist=bot.blocklist,
+                    breaker=breaker,
+                    coordinator=bot.coordinator,
+                )
+
+                for feed in sharded_feeds(bot.feeds):
+                    reload_sources(bot.artifact)
+                    http_session.headers.update({"User-Agent": ua})
+
+                    poll_feed(
+                        feed,
+                        bot.conn,
+                        bot.seen_filter,
+                        http_session,
+                        blocklist=bot.blocklist,
+                        breaker=breaker,
+                        coordinator=bot.coordinator,
+                    )
+
+            # Each bot's digest is flushed even if another's fails to post. The
+            # posts that didn't go out stay queued for the next run.
+            for bot in bots:
+                bot.activate()
+                try:
+                    flush_digest(bot.conn)
+                except Exception as e:  # noqa: BLE001 - the other bots still get theirs
+                    print(f"Unable to post the digest for {bot.home}: {e}")
+    finally:
+        for bot in bots:
+            bot.close()
 
 
 if __name__ == "__main__":
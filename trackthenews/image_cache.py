@@ -0,0 +1,100 @@
+import hashlib
+import os
+
+# Bump whenever rendering changes in a way the key doesn't capture, so images
+# rendered by an older version are never served.
+IMAGE_CACHE_VERSION = 1
+
+
+def image_key(*parts):
+    """Return a cache key for an image rendered from the given inputs."""
+    digest = hashlib.sha256(str(IMAGE_CACHE_VERSION).encode("utf-8"))
+    for part in parts:
+        # Length-prefix each part so that ("ab", "c") and ("a", "bc") differ.
+        part = str(part).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ImageCache:
+    """
+    A directory of encoded images, named by the hash of what they were
+    rendered from and capped at max_bytes.
+
+    Files are touched whenever they're read, so when the cap is exceeded the
+    least recently used ones are evicted first. The directory may be shared
+    by several processes; each one only ever replaces whole files, and
+    re-reads the directory before evicting.
+    """
+
+    def __init__(self, directory, max_bytes, extension):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.size = None
+
+    def path(self, key):
+        return os.path.join(self.directory, f"{key}.{self.extension}")
+
+    def get(self, key):
+        """Return the cached image for key, or None."""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        """Cache an image, evicting older ones if that takes the cache over its cap."""
+        if len(data) > self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self.size is None:
+            self.size = sum(size for _, size, _ in self._entries())
+
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Unable to cache image: {e}")
+            return
+
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used images until the cache fits under its cap."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def _entries(self):
+        """Yield (path, size, mtime) for every cached image."""
+        suffix = f".{self.extension}"
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(suffix):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield entry.path, st.st_size, st.st_mtime_ns
+        except FileNotFoundError:
+            return
@@ -0,0 +1,63 @@
+import re
+
+
+def trie_pattern(words):
+    """
+    Return a regular expression source that matches any of words.
+
+    The words are folded into a prefix trie first, so the regex engine walks
+    shared prefixes once instead of retrying every alternative at every
+    position. Since we only ever ask whether a paragraph matches at all, a
+    word that has another word as a prefix is redundant and is dropped.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            if "" in node:
+                break
+            node = node.setdefault(char, {})
+        else:
+            node.clear()
+            node[""] = True
+
+    return _trie_to_regex(trie)
+
+
+def _trie_to_regex(node):
+    if "" in node:
+        return ""
+
+    branches = [re.escape(char) + _trie_to_regex(child) for char, child in sorted(node.items())]
+    if len(branches) == 1:
+        return branches[0]
+    return "(?:" + "|".join(branches) + ")"
+
+
+class Matcher:
+    """Checks paragraphs against the case-insensitive and case-sensitive matchlists."""
+
+    def __init__(self, words, words_case_sensitive):
+        self.words = list(dict.fromkeys(words))
+        self.words_case_sensitive = list(dict.fromkeys(words_case_sensitive))
+
+        # Case-insensitive words are matched against a lowercased paragraph,
+        # rather than with re.IGNORECASE, so that matching agrees exactly with
+        # comparing str.lower() on both sides.
+        self.pattern = (
+            re.compile(trie_pattern(w.lower() for w in self.words)) if self.words else None
+        )
+        self.pattern_case_sensitive = (
+            re.compile(trie_pattern(self.words_case_sensitive))
+            if self.words_case_sensitive
+            else None
+        )
+
+    def __bool__(self):
+        return bool(self.words or self.words_case_sensitive)
+
+    def matches(self, graf):
+        """Return whether graf contains any of the words."""
+        if self.pattern and self.pattern.search(graf.lower()):
+            return True
+        return bool(self.pattern_case_sensitive and self.pattern_case_sensitive.search(graf))
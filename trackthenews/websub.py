@@ -0,0 +1,258 @@
+"""
+A WebSub (formerly PubSubHubbub) subscriber.
+
+Feeds that advertise a hub can push new entries to us as soon as they are
+published, instead of waiting to be polled. The listener here subscribes to
+those hubs, answers their verification requests, and hands pushed feed bodies
+over to the main thread through a queue, where they go through the same
+pipeline as polled feeds.
+
+See https://www.w3.org/TR/websub/ for the protocol.
+"""
+
+import hashlib
+import hmac
+import queue
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import feedparser
+
+# Pushed bodies bigger than this are refused rather than read into memory.
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+# Subscriptions are renewed this long before their lease runs out, and a
+# subscription request the hub never verified is retried after this long.
+RENEW_MARGIN_SECONDS = 60 * 60
+
+# A feed that didn't advertise a hub is checked again after this long.
+DISCOVERY_INTERVAL_SECONDS = 24 * 60 * 60
+
+SIGNATURE_METHODS = {"sha1", "sha256", "sha384", "sha512"}
+
+
+def discover_hub(url, http_session, timeout=30):
+    """
+    Fetch a feed and return its (hub, topic) URLs, or None if it has no hub.
+
+    Hubs may be advertised in Link headers or in the feed's own links, and
+    the topic is the feed's self link, falling back to the URL we fetched.
+    """
+    response = http_session.get(url, timeout=timeout)
+    response.raise_for_status()
+
+    links = {rel: link["url"] for rel, link in response.links.items()}
+    for link in feedparser.parse(response.text)["feed"].get("links", []):
+        if link.get("rel") in ("hub", "self") and link.get("href"):
+            links.setdefault(link["rel"], link["href"])
+
+    if "hub" not in links:
+        return None
+    return links["hub"], links.get("self", url)
+
+
+def callback_path(topic):
+    """
+    Return the callback path for a topic.
+
+    Deriving it from the topic means a restarted listener reuses the same
+    callback, so resubscribing replaces the hub's old subscription rather
+    than adding a second one.
+    """
+    return "/" + hashlib.sha256(topic.encode("utf-8")).hexdigest()[:32]
+
+
+class Subscription:
+    def __init__(self, hub, topic, feed, secret, previous_secret=None):
+        self.hub = hub
+        self.topic = topic
+        self.feed = feed
+        self.secret = secret
+        # Until the hub verifies a renewal, it may still sign with the old secret.
+        self.previous_secret = previous_secret
+        self.requested_at = time.time()
+        self.expires_at = None
+
+    @property
+    def active(self):
+        return self.expires_at is not None and self.expires_at > time.time()
+
+    def valid_signature(self, header, body):
+        method, _, signature = (header or "").partition("=")
+        if method not in SIGNATURE_METHODS:
+            return False
+        for secret in (self.secret, self.previous_secret):
+            if secret:
+                expected = hmac.new(secret.encode("utf-8"), body, method).hexdigest()
+                if hmac.compare_digest(expected, signature):
+                    return True
+        return False
+
+
+class _CallbackHandler(BaseHTTPRequestHandler):
+    def _respond(self, status, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Answer a hub's verification of a subscription request."""
+        listener = self.server.listener
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        subscription = listener.subscription_for_path(url.path)
+
+        if subscription is None or params.get("hub.topic") != subscription.topic:
+            self._respond(404)
+            return
+
+        mode = params.get("hub.mode")
+        if mode == "subscribe" and "hub.challenge" in params:
+            lease_seconds = int(params.get("hub.lease_seconds", listener.lease_seconds))
+            subscription.expires_at = time.time() + lease_seconds
+            print(f"Subscribed to {subscription.topic} for {lease_seconds} seconds.")
+            self._respond(200, params["hub.challenge"].encode("utf-8"))
+        elif mode == "denied":
+            print(f"Hub denied subscription to {subscription.topic}: {params.get('hub.reason')}")
+            subscription.expires_at = None
+            self._respond(200)
+        else:
+            # We never unsubscribe, so anything else wasn't requested by us.
+            self._respond(404)
+
+    def do_POST(self):
+        """Accept a pushed feed body and queue it for the main thread."""
+        listener = self.server.listener
+        subscription = listener.subscription_for_path(urlsplit(self.path).path)
+        if subscription is None:
+            # 410 tells the hub to stop delivering to this callback.
+            self._respond(410)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY_BYTES:
+            self._respond(413)
+            return
+        body = self.rfile.read(length)
+
+        # The spec asks us to acknowledge bad signatures anyway, so that a
+        # forger can't tell whether they got it right.
+        if subscription.valid_signature(self.headers.get("X-Hub-Signature"), body):
+            listener.pushed.put((subscription.feed, body))
+        else:
+            print(f"Ignoring push for {subscription.topic} with a bad signature.")
+        self._respond(202)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebSubListener:
+    """
+    An HTTP server that receives WebSub verification requests and pushes.
+
+    callback_url is the public URL that reaches the server, which is usually
+    behind a reverse proxy, so it can't be derived from host and port.
+    """
+
+    def __init__(self, callback_url, host="127.0.0.1", port=8080, lease_seconds=None):
+        self.callback_url = callback_url.rstrip("/")
+        self.lease_seconds = lease_seconds or 10 * 24 * 60 * 60
+        self.pushed = queue.Queue()
+        self.subscriptions = {}
+        self.hubless = {}
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer((host, port), _CallbackHandler)
+        self.server.daemon_threads = True
+        self.server.listener = self
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def subscription_for_path(self, path):
+        with self.lock:
+            return self.subscriptions.get(path)
+
+    def subscription_for_feed(self, feed_url):
+        with self.lock:
+            for subscription in self.subscriptions.values():
+                if subscription.feed["url"] == feed_url:
+                    return subscription
+        return None
+
+    def is_subscribed(self, feed_url):
+        """Return whether a feed currently has pushes coming in."""
+        subscription = self.subscription_for_feed(feed_url)
+        return subscription is not None and subscription.active
+
+    def renew_at(self, feed_url):
+        """Return when an active subscription to a feed is due for renewal, or None."""
+        subscription = self.subscription_for_feed(feed_url)
+        if subscription is None or subscription.expires_at is None:
+            return None
+        return subscription.expires_at - RENEW_MARGIN_SECONDS
+
+    def needs_subscription(self, feed_url):
+        """Return whether it's time to look for a feed's hub and (re)subscribe to it."""
+        now = time.time()
+        if self.hubless.get(feed_url, 0) + DISCOVERY_INTERVAL_SECONDS > now:
+            return False
+
+        subscription = self.subscription_for_feed(feed_url)
+        if subscription is None:
+            return True
+        if subscription.expires_at is None:
+            return subscription.requested_at + RENEW_MARGIN_SECONDS < now
+        return subscription.expires_at - RENEW_MARGIN_SECONDS < now
+
+    def subscribe(self, feed, http_session, timeout=30):
+        """Discover a feed's hub, if any, and ask it to push the feed to us."""
+        discovered = discover_hub(feed["url"], http_session, timeout=timeout)
+        if discovered is None:
+            self.hubless[feed["url"]] = time.time()
+            return None
+
+        hub, topic = discovered
+        path = callback_path(topic)
+        with self.lock:
+            previous = self.subscriptions.get(path)
+            subscription = Subscription(
+                hub,
+                topic,
+                feed,
+                secrets.token_hex(32),
+                previous_secret=previous.secret if previous else None,
+            )
+            if previous:
+                subscription.expires_at = previous.expires_at
+            self.subscriptions[path] = subscription
+
+        response = http_session.post(
+            hub,
+            data={
+                "hub.mode": "subscribe",
+                "hub.topic": topic,
+                "hub.callback": self.callback_url + path,
+                "hub.secret": subscription.secret,
+                "hub.lease_seconds": self.lease_seconds,
+            },
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        print(f"Requested WebSub subscription to {topic} from {hub}.")
+        return subscription